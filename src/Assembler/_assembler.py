@@ -1,13 +1,35 @@
+import mmap
+import os
+import re
+import shlex
+
+from .cfg import eliminate_dead_code
+from .datapack import pack_data
+from .ir import Data, Instruction, Label, layout
+from .macros import MAX_EXPANSION_DEPTH, Macro, parse_block, read_block, unroll
+from .objectfile import build_object
+from .outliner import outline
+
+
 class Assembler:
 
     def __init__(self):
         print("Assembler initialized.")
-        self.intermediate_buffer = ()
+        self.intermediate_buffer = []  # Label, Instruction and Data entries, see ir.py
         self.final_buffer = []
         self.starting_address = None   # this is the address where the program will start executing from.
         self.program_counter = 0x200
         self.sprite_counter = 0x000
         self.label_table = dict()
+        self.mapped_files = []     # files mapped by .incbin, kept open until the ROM image has been written.
+        self.optimize_size = False  # move repeated instruction sequences into shared subroutines.
+        self.eliminate_dead_code = False  # drop unreachable code and data nothing refers to.
+        self.pack_data = False  # store duplicate and overlapping labeled data blocks once.
+        self.compile_only = False  # build a relocatable object file instead of a ROM image, see objectfile.py
+        self.object_file = None
+        self.module_name = "<module>"
+        self.macros = dict()  # name to Macro, see macros.py
+        self.expansion_count = 0  # numbers the \@ of every macro expansion.
 
     def fetch_opcode(self, words) -> str:
 
@@ -42,11 +64,11 @@ class Assembler:
                 # it's ADD I, VX
                 result = 'F{}1E'.format(operand_2)
 
-            if operand_2.startswith('V'):
+            elif operand_2.startswith('V'):
                 # it's ADD VX, VY
                 result = '8{}{}4'.format(operand_1, operand_2)
 
-            if operand_2.startswith('#'):
+            elif operand_2.startswith('#'):
                 # it's ADD VX, #
                 result = '7{}{}'.format(operand_1, operand_2)
 
@@ -82,19 +104,29 @@ class Assembler:
 
             result = None
 
-            if operand_1.startswith("V"):
-                # it's JP VX, #
-                result = 'B{}{}'.format(operand_1, operand_2)
+            if operand_1.startswith("V") and operand_2 is not None:
+                # it's JP V0, #, the register is always V0 so only the address is encoded.
+                operand_2 = operand_2.replace('0x', '')
+                result = 'B{}'.format(operand_2.zfill(3))
             elif operand_1.startswith("0x"):
                 # it's JP #
                 operand_1 = operand_1.replace('0x', '')  # remove the 0x from the hex value  before we insert it
-                result = '1{}'.format(operand_1)
+                result = '1{}'.format(operand_1.zfill(3))
             else:
                 raise ValueError('JP instruction is invalid.')
 
             # remove the 'vx' and 'vy' from the opcode and the # from the second parameter then return.
             return result.replace('#', '').replace('V', '')
 
+        def determine_CALL(tuple):
+
+            operand_1 = tuple[1]
+
+            if not operand_1.startswith("0x"):
+                raise ValueError('CALL instruction is invalid.')
+
+            return '2{}'.format(operand_1.replace('0x', '').zfill(3))
+
         def determine_LD(tuple_):
 
             operand_1 = str(tuple_[1])
@@ -106,7 +138,7 @@ class Assembler:
                 # it's LD VX, #
                 operand_2 = operand_2.replace('#', '')
                 operand_2 = int(operand_2, 16)
-                result = '6{}{}'.format(operand_1, operand_2)
+                result = '6{}{:02X}'.format(operand_1, operand_2)
             elif operand_1.startswith("V") and operand_2.startswith("V"):
                 # it's LD VX, VY
                 result = '8{}{}0'.format(operand_1, operand_2)
@@ -115,7 +147,7 @@ class Assembler:
                 operand_2 = operand_2.replace('0x', '')
                 operand_2 = int(operand_2, 16)
                 operand_2 = hex(operand_2).replace('0x', '')
-                result = 'A{}'.format(operand_2)
+                result = 'A{}'.format(operand_2.zfill(3))
             elif operand_1.startswith("[I]") and operand_2.startswith("V"):
                 # it's LD [I], VX
                 result = 'F{}55'.format(operand_2)
@@ -150,6 +182,7 @@ class Assembler:
 
         opcode_table = {
             # all non-repeating opcodes
+            'AND': '8{}{}2',
             'CLS': '00E0',
             'DRW': 'D{}{}{}',
             'OR': '8{}{}1',
@@ -166,7 +199,7 @@ class Assembler:
         }
 
         operand = words[0]
-        param1 = words[1]
+        param1 = words[1] if len(words) > 1 else None
         param2 = words[2] if len(words) > 2 else None
         param3 = words[3] if len(words) > 3 else None
 
@@ -174,6 +207,10 @@ class Assembler:
 
         # fetch the opcode from the opcode table
 
+        if operand in ('SHL', 'SHR') and param2 is None:
+            # SHL VX is short for SHL VX, VX
+            param2 = param1
+
         if operand in opcode_table:
             unformatted_opcode = opcode_table[operand]
 
@@ -182,7 +219,7 @@ class Assembler:
                 result = unformatted_opcode.format(param1, param2, param3).replace('V', '').replace('#', '')
             else:
                 # now we format the opcode based on the number of parameters, we also remove the 'vx' and 'vy' from the opcode
-                result = unformatted_opcode.format(param1, param2)
+                result = unformatted_opcode.format(param1, param2).replace('V', '').replace('#', '')
 
         # if the opcode is not in the opcode table, then it is an opcode that shares mnemonics with other opcodes
         # so we need to determine which opcode it is based on the final parameter
@@ -195,6 +232,8 @@ class Assembler:
             result = determine_SNE(words)
         elif operand == 'JP':
             result = determine_JP(words)
+        elif operand == 'CALL':
+            result = determine_CALL(words)
         elif operand == 'LD':
             result = determine_LD(words)
 
@@ -210,32 +249,117 @@ class Assembler:
         parameters = line.split()[1:]
 
         if directive == '.db':
-            # it's a directive
+            # it's a directive, all of its bytes are stored as one block of data.
 
+            values = []
             for parameter in parameters:
 
-                if parameter.startswith("0x"):
-                    # it's a hex value
-                    parameter = parameter.replace("0x", "")
-                    self.intermediate_buffer += (parameter,)
-                elif parameter.startswith("#"):
-                    # it's a decimal value
-                    parameter = parameter.replace("#", "")
-                    parameter = parameter.zfill(4)
-                self.intermediate_buffer += (parameter,)
+                value = self.parse_number(parameter)
+
+                if value > 0xFF:
+                    raise ValueError(f'.db value {parameter} does not fit in a byte.')
+
+                values.append(value)
+
+            self.intermediate_buffer.append(Data(bytes(values)))
+            self.program_counter += len(values)   # go to next address in memory for next instruction
+
+        elif directive == '.incbin':
+            # it's a binary include, the parameters may contain a quoted file name so we split it shell style.
+            self.handle_incbin(shlex.split(line)[1:])
+
+        elif directive == '.sprite':
+            self.handle_sprite(shlex.split(line)[1:])
+
+    def handle_incbin(self, parameters):
+        """
+        Handles the .incbin "file" [, offset, length] directive.
+
+        The file is memory mapped and only a view of the requested range is stored in the intermediate buffer, the
+        bytes are copied exactly once, straight into the ROM image, when the file is written.
+        :param parameters: the file name followed by the optional offset and length.
+        :type parameters: list
+        """
+
+        if len(parameters) == 0 or len(parameters) > 3:
+            raise ValueError('.incbin directive is invalid.')
+
+        file_name = parameters[0]
+        offset = self.parse_number(parameters[1]) if len(parameters) > 1 else 0
+
+        # a negative offset or length would count from the end of the file, like a slice.
+        if offset < 0:
+            raise ValueError(f'.incbin offset {offset} is negative.')
 
-                # Every time a .db directive is used, it gets stored first in memory. In order to prevent
-                # the interpreter from accidentally executing the data, we need to store the starting address
-                # this way we can jump to the starting address after the data has been stored in memory.
-                self.starting_address = self.program_counter
+        with open(file_name, "rb") as file:
+            file.seek(0, 2)
+            file_size = file.tell()
 
-                self.program_counter += 1   # go to next address in memory for next instruction
+            if offset > file_size:
+                raise ValueError(f'.incbin offset {offset} is past the end of {file_name}.')
 
+            length = self.parse_number(parameters[2]) if len(parameters) > 2 else file_size - offset
 
-    def read_file(self):
+            if length < 0:
+                raise ValueError(f'.incbin length {length} is negative.')
+
+            if offset + length > file_size:
+                raise ValueError(f'.incbin range {offset}:{offset + length} is past the end of {file_name}.')
+
+            # whether it fits below 0xFFF is only known once the layout is done, see ir.layout.
+
+            if length == 0:
+                # empty files can't be mapped, and there is nothing to include anyway.
+                return
+
+            mapped_file = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(mapped_file)[offset:offset + length]
+        self.mapped_files.append((mapped_file, view))
+        self.intermediate_buffer.append(Data(view, f'.incbin of {file_name}'))
+
+        self.program_counter += length
+
+    def handle_sprite(self, parameters):
+        """
+        Handles the .sprite "file.pbm" [threshold] directive.
+
+        The image is sliced into 8 pixel wide, up to 15 row tall sprites. Every tile gets a label made of the image
+        name and the tile number, eg. ship_0, ship_1, ... in row major order.
+        :param parameters: the image file name followed by the optional PGM threshold.
+        :type parameters: list
+        """
+
+        # imported here so numpy is only needed by sources that actually use sprites.
+        from .sprites import load_tiles
+
+        if len(parameters) == 0 or len(parameters) > 2:
+            raise ValueError('.sprite directive is invalid.')
+
+        file_name = parameters[0]
+        threshold = self.parse_number(parameters[1]) if len(parameters) > 1 else None
+
+        name = os.path.splitext(os.path.basename(file_name))[0]
+
+        for count, tile in enumerate(load_tiles(file_name, threshold)):
+            self.intermediate_buffer.append(Label(f'{name}_{count}'))
+            self.intermediate_buffer.append(Data(tile, f'.sprite {file_name} tile {count}'))
+            self.program_counter += len(tile)
+
+    def release_mapped_files(self):
+        # views have to be released before the map can be closed.
+        for mapped_file, view in self.mapped_files:
+            view.release()
+            mapped_file.close()
+
+        self.mapped_files = []
+
+    def read_file(self, file_name="source.txt"):
+
+        self.module_name = file_name
 
         # read the source file remove all comments.
-        with open("source.txt", "r") as file:
+        with open(file_name, "r") as file:
             contents = file.read()
 
 
@@ -245,8 +369,8 @@ class Assembler:
 
         for count, line in enumerate(lines):
 
-            # remove all all commas.
-            line = line.replace(',', '')
+            # remove all all commas, but those in quoted file names.
+            line = self.remove_commas(line)
 
             # remove all comments
             if ";" in line:
@@ -258,81 +382,210 @@ class Assembler:
 
         lines = clean_lines
 
-        # first pass, handle labels and directives
-        # we will build a new list with the lines that are not labels or directives, to use in second pass
-        for count, line in enumerate(lines):
+        self.first_pass(lines)
+        self.second_pass()
+
+    def first_pass(self, lines):
+        """
+        Builds the intermediate buffer out of the source lines, labels and directives are handled here.
+        :param lines: source lines, without comments and commas.
+        :type lines: list
+        """
+
+        # every line is split into words once, macros and repeats work on the words.
+        self.process_lines([line.split() for line in lines])
+
+        # Directives can store data in memory before any instruction. In order to prevent the interpreter from
+        # accidentally executing the data, we jump over it to the first instruction. An object file keeps its data in
+        # a section of its own, after all the code, so there's nothing to jump over there.
+        first_instruction = None
+        for count, entry in enumerate(self.intermediate_buffer):
+            if isinstance(entry, Instruction):
+                first_instruction = count
+                break
+
+        if not self.compile_only and first_instruction is not None and \
+                any(isinstance(entry, Data) for entry in self.intermediate_buffer[:first_instruction]):
+            self.intermediate_buffer.insert(first_instruction, Label('__start'))
+            self.intermediate_buffer.insert(0, Instruction(['JP', '$__start']))
+
+        print("Intermediate buffer -- first pass: " + str(self.intermediate_buffer))
+
+    def process_lines(self, lines, depth=0):
+        """
+        Adds source lines to the intermediate buffer, defining and expanding macros and repeats on the way.
+        :param lines: the lines, split into words.
+        :type lines: list
+        :param depth: how many macro expansions the lines are nested in.
+        :type depth: int
+        """
 
-            if line == "":
+        if depth > MAX_EXPANSION_DEPTH:
+            raise ValueError(f'Macros are nested more than {MAX_EXPANSION_DEPTH} deep, does a macro use itself?')
+
+        count = 0
+        while count < len(lines):
+            words = lines[count]
+            count += 1
+
+            if not words:
                 continue
 
-                # check if it's a directive ignore whitespace
-            if line.endswith(":"):
-                # it's a new label
+            if words[0] == '.macro':
+                if len(words) < 2:
+                    raise ValueError('.macro directive is invalid.')
 
-                label = line.replace(":", "")
-                self.label_table[label] = hex(self.program_counter)
+                body, count = read_block(lines, count, '.macro', '.endm')
+                self.macros[words[1]] = Macro(words[1], list(words[2:]), parse_block(body))
                 continue
 
-            if line.startswith("."):
-                # it's a directive
+            if words[0] == '.rept':
+                start = count - 1
+                body, count = read_block(lines, count, '.rept', '.endr')
+                self.process_lines(unroll(parse_block(lines[start:count]), {}, self.parse_number), depth)
+                continue
 
-                self.handle_directives(line)
+            if words[0] in self.macros:
+                self.expand_macro(self.macros[words[0]], words[1:], depth)
                 continue
 
-            # Add the line to the intermediate buffer if it's not a label or directive.
-            self.intermediate_buffer += (line,)
+            self.add_line(words)
 
-        print("Intermediate buffer -- first pass: " + str(self.intermediate_buffer))
+    def expand_macro(self, macro, arguments, depth):
+        expansion = macro.expand(list(arguments), self.parse_number)
 
-        # second pass, handle instructions
-        for line in self.intermediate_buffer:
+        if macro.uses_counter:
+            # only the \@ of this expansion are substituted, the cached expansion is left as it is.
+            self.expansion_count += 1
+            number = str(self.expansion_count)
+            expansion = [tuple(word.replace('\\@', number) for word in words) for words in expansion]
 
-            words = line.split()
+        self.process_lines(expansion, depth + 1)
 
-            # check if its a hex value
-            if self.is_hex(line):
-                self.final_buffer += (line,)
-                self.program_counter += 1
-                continue
+    def add_line(self, words):
 
-            # ignore blank lines.
-            if len(words) == 0:
-                continue
+        line = " ".join(words)
 
-            opcode_obtained = False  # flag to mark if opcode has been processed
-            for count, word in enumerate(words):
-
-                key = word[1:]  # remove the $ from the label
-                if word.startswith("$") and key in self.label_table:
-                    # it's a label
-                    words[count] = self.label_table[key]
-                    opcode_hex = self.fetch_opcode(words)
-                    self.final_buffer += (opcode_hex,)
-                    self.program_counter += 2
-                    opcode_obtained = True
-                    break  # exit the loop early if opcode has been added
-
-            # Only generate opcode if not already done when processing a label
-            if not opcode_obtained:
-                opcode_hex = self.fetch_opcode(words)
-                self.final_buffer += (opcode_hex,)
-                self.program_counter += 2
+        # check if it's a directive ignore whitespace
+        if line.endswith(":"):
+            # it's a new label, it gets its address once all passes are done with the buffer.
+
+            label = line.replace(":", "")
+            self.intermediate_buffer.append(Label(label))
+            return
+
+        if line.startswith("."):
+            # it's a directive
+
+            if words[0] in ('.endm', '.endr'):
+                raise ValueError(f'{words[0]} without a matching {".macro" if words[0] == ".endm" else ".rept"}.')
 
+            self.handle_directives(line)
+            return
+
+        # Add the line to the intermediate buffer if it's not a label or directive.
+        self.intermediate_buffer.append(Instruction(words))
+        self.program_counter += 2
+
+    def second_pass(self):
+        """
+        Runs the optimization passes over the intermediate buffer, gives every label its address and encodes the
+        instructions into the final buffer.
+        """
+
+        if self.eliminate_dead_code:
+            # other modules can call the global labels of a module, so those are reachable too.
+            roots = [entry.name for entry in self.intermediate_buffer
+                     if self.compile_only and isinstance(entry, Label) and not entry.name.startswith("__")]
+
+            self.intermediate_buffer, removed = eliminate_dead_code(self.intermediate_buffer, roots)
+            print(f"Dead code elimination -- removed {len(removed)} blocks, {sum(len(block) for block in removed)} "
+                  f"bytes")
+            for block in removed:
+                kind = "data" if block.is_data else "code"
+                print(f"    {kind} block {block.index} {block.labels}: {len(block)} bytes")
+
+        if self.optimize_size:
+            self.intermediate_buffer, saved, subroutines = outline(self.intermediate_buffer, self.instruction_key)
+            print(f"Size optimization -- {subroutines} subroutines extracted, {saved} bytes saved")
+
+        if self.pack_data:
+            # after outlining, the packed data goes at the very end so the subroutines stay at even addresses.
+            self.intermediate_buffer, saved = pack_data(self.intermediate_buffer)
+            print(f"Data packing -- {saved} bytes saved")
+
+        if self.compile_only:
+            # the linker gives the labels their addresses.
+            self.object_file = build_object(self.intermediate_buffer, self.fetch_opcode, self.module_name)
+            print(f"Compile only -- {self.object_file}")
+            return
+
+        self.label_table = {label: hex(address) for label, address in layout(self.intermediate_buffer).items()}
+
+        if '__start' in self.label_table:
+            self.starting_address = int(self.label_table['__start'], 16)
+
+        self.program_counter = 0x200
+
+        for entry in self.intermediate_buffer:
+
+            # binary data is already in its final form, it is copied as is.
+            if isinstance(entry, Data):
+                self.final_buffer.append(entry.payload)
+                self.program_counter += len(entry)
+
+            elif isinstance(entry, Instruction):
+                self.final_buffer.append(self.encode(entry))
+                self.program_counter += 2
 
-        # if the starting address is not 0x200, then we need to add a JP instruction to jump to the starting address
-        # this is due to usage of directives and labels being declared before any instructions are processed. To
-        # prevent the interpreter from executing the data (which is not a valid instruction), we need to jump over it.
-        if self.starting_address is not None:
-            jp_hex = f"1{hex(self.starting_address).replace('0x', '')}"
-            self.final_buffer.insert(0, jp_hex)
         print("second pass -- intermediate buffer: " + str(self.final_buffer))
 
-    def write_file(self):
+    def encode(self, instruction):
+        """
+        Encodes an instruction, replacing its label reference with the address of the label.
+        :param instruction:
+        :type instruction: Instruction
+        :return: the opcode as a hex string.
+        :rtype: str
+        """
+
+        words = list(instruction.words)
+
+        for count, word in enumerate(words):
+
+            key = word[1:]  # remove the $ from the label
+            if word.startswith("$"):
+                if key not in self.label_table:
+                    raise ValueError(f'Label {key} is not declared.')
+
+                words[count] = self.label_table[key]
+
+        return self.fetch_opcode(words)
+
+    def instruction_key(self, instruction):
+        # Instructions compare equal when they encode to the same opcode. The address of a label isn't known
+        # while the passes run, so those are compared by label instead.
+        if instruction.label_reference() is not None:
+            return tuple(word.upper() for word in instruction.words)
+
+        return int(self.fetch_opcode(list(instruction.words)), 16)
+
+    def write_file(self, file_name=None):
+
+        if self.compile_only:
+            self.object_file.write(file_name or os.path.splitext(self.module_name)[0] + ".o")
+            self.release_mapped_files()
+            return
+
         # convert to bytes and write to file
-        with open("output.c8", "wb") as file:
+        with open(file_name or "output.c8", "wb") as file:
             bytes_ = bytearray()
 
             for line in self.final_buffer:
+                if self.is_binary(line):
+                    bytes_ += line  # single copy from the mapped file into the image.
+                    continue
+
                 bytes_.append(int(line[:2], 16))
                 bytes_.append(int(line[2:], 16))
 
@@ -340,9 +593,26 @@ class Assembler:
 
             file.write(bytes_)
 
+        self.release_mapped_files()
+
     def convert_to_hex(self, decimal_value):
         return hex(decimal_value).replace('0x', '').upper()
 
+    def remove_commas(self, line):
+        # the quoted parts of the line are the odd ones after the split, they're left as they are.
+        parts = re.split(r'("[^"]*"|\'[^\']*\')', line)
+        return "".join(part if count % 2 else part.replace(',', '') for count, part in enumerate(parts))
+
+    def parse_number(self, s):
+        # the numbers of every directive are written like the bytes of .db: hex with or without the 0x, or decimal
+        # after a #. .incbin f 10 includes 0x10 bytes, like .db 10 stores 0x10.
+        if s.startswith("#"):
+            return int(s[1:])
+        return int(s, 16)
+
+    def is_binary(self, s):
+        return isinstance(s, (bytes, bytearray, memoryview))
+
     def is_hex(self, s):
         try:
             int(s, 16)
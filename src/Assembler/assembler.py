@@ -1,12 +1,39 @@
+import os
+
+from src.Assembler._assembler import Assembler as Backend
+from src.Assembler.codegen import CodeGenerator
 from src.Assembler.lexer import Lexer
+from src.Assembler.linker import link
 from src.Assembler.parser import Parser
 
+# Sources with these extensions are plain assembly, read line by line by the backend. Anything else is parsed.
+ASSEMBLY_EXTENSIONS = (".asm", ".s", ".c8asm")
+
+
 class Assembler:
 
-    def __init__(self):
+    def __init__(self, compile_only=False):
         self.lexer = Lexer()
+        self.backend = Backend()  # lays out and encodes the generated code.
+        self.backend.compile_only = compile_only
+        self.superoptimize = False  # search for shorter code for short expressions, see superopt.
+
+    def assemble(self, file_name, output=None):
+        """
+        Assembles a source into a ROM image, or into an object file with compile only.
+        :param file_name: the source file.
+        :type file_name: str
+        :param output: the file to write, by default output.c8, or the source name with .o with compile only.
+        :type output: str
+        """
+
+        self.backend.module_name = file_name
+
+        if file_name.endswith(ASSEMBLY_EXTENSIONS):
+            self.backend.read_file(file_name)
+            self.backend.write_file(output)
+            return
 
-    def assemble(self, file_name):
         token_sequence_list = self.lexer.analyze_file(file_name)
 
         print("TOKEN_SEQUENCE_LIST:")
@@ -15,12 +42,36 @@ class Assembler:
 
 
         parser = Parser(token_sequence_list)
-        nodes = parser.parse_expression()
+        nodes = parser.parse_lines()
         nodes.print_tree()
 
+        self.backend.intermediate_buffer = CodeGenerator(superoptimize=self.superoptimize).generate(nodes)
+        self.backend.second_pass()
+        self.backend.write_file(output)
 
+    def assemble_modules(self, file_names, output="output.c8"):
+        """
+        Compiles every source into an object file in memory and links them into one ROM image.
+        :param file_names: the sources, the first one holds the entry point.
+        :type file_names: list
+        :param output: the ROM file to write.
+        :type output: str
+        """
 
+        objects = []
 
+        for file_name in file_names:
+            assembler = Assembler(compile_only=True)
+            assembler.backend.optimize_size = self.backend.optimize_size
+            assembler.backend.eliminate_dead_code = self.backend.eliminate_dead_code
+            assembler.backend.pack_data = self.backend.pack_data
+            assembler.superoptimize = self.superoptimize
 
+            # only keep the object, the linker writes the image.
+            assembler.assemble(file_name, os.devnull)
+            objects.append(assembler.backend.object_file)
 
+        image, symbols = link(objects)
 
+        with open(output, "wb") as file:
+            file.write(image)
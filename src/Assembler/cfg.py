@@ -0,0 +1,206 @@
+"""
+Control flow graph of the intermediate buffer, used to drop code that can never run and data nothing refers to.
+
+Blocks are split at labels and after JP, CALL, RET and skip instructions. A skip is a two way branch over the next
+word, so the instruction after it gets a block of its own. Data gets blocks of its own too, those are kept when a
+reachable instruction refers to one of their labels.
+"""
+
+from .ir import Data, Instruction, Label
+
+
+class BasicBlock:
+
+    def __init__(self, index):
+        self.index = index  # position of the block in the program.
+        self.entries = []
+        self.successors = []
+        self.is_data = False
+
+    @property
+    def labels(self):
+        return [entry.name for entry in self.entries if isinstance(entry, Label)]
+
+    @property
+    def instructions(self):
+        return [entry for entry in self.entries if isinstance(entry, Instruction)]
+
+    def __len__(self):
+        return sum(len(entry) for entry in self.entries)
+
+    def __repr__(self):
+        return f"BasicBlock({self.index}, labels={self.labels}, {len(self)} bytes)"
+
+
+def split_blocks(buffer):
+    """
+    Splits the buffer into basic blocks, in program order.
+    :param buffer: list of Label, Instruction and Data entries.
+    :type buffer: list
+    :rtype: list
+    """
+
+    blocks = []
+    current = None
+    after_skip = False
+
+    for entry in buffer:
+        is_label = isinstance(entry, Label)
+        is_data = isinstance(entry, Data)
+
+        if current is not None:
+            has_contents = any(not isinstance(item, Label) for item in current.entries)
+
+            # labels start a new block, and code and data never share one.
+            if (is_label and has_contents) or (not is_label and has_contents and current.is_data != is_data):
+                current = None
+
+        if current is None:
+            current = BasicBlock(len(blocks))
+            blocks.append(current)
+
+        current.entries.append(entry)
+
+        if is_data:
+            current.is_data = True
+
+        if isinstance(entry, Instruction):
+            ends_block = entry.is_control_flow() or after_skip
+            after_skip = entry.is_skip()
+
+            if ends_block:
+                current = None
+
+    return blocks
+
+
+def build_cfg(buffer):
+    """
+    Builds the control flow graph of the buffer.
+    :param buffer: list of Label, Instruction and Data entries.
+    :type buffer: list
+    :return: the blocks with their successors filled in, None when a jump target can't be worked out statically.
+    :rtype: list
+    """
+
+    blocks = split_blocks(buffer)
+    label_blocks = {label: block for block in blocks for label in block.labels}
+
+    def is_table_entry(block):
+        instructions = block.instructions
+        return len(instructions) == 1 and instructions[0].is_jump() and not instructions[0].is_computed_jump()
+
+    for block in blocks:
+        if block.is_data:
+            continue
+
+        following = blocks[block.index + 1] if block.index + 1 < len(blocks) else None
+        instructions = block.instructions
+        last = instructions[-1] if instructions else None
+
+        if last is None or not last.is_control_flow() or last.mnemonic == "SYS":
+            # falls through to the next block.
+            if following is not None:
+                block.successors.append(following)
+            continue
+
+        target = last.label_reference()
+
+        if last.is_return():
+            continue
+
+        if last.is_skip():
+            block.successors += blocks[block.index + 1:block.index + 3]
+            continue
+
+        if target not in label_blocks:
+            # a jump or call to a numeric address, we can't tell what it reaches.
+            return None
+
+        if last.is_computed_jump():
+            # JP V0, table can land on any entry of the jump table starting at the label. When the label isn't
+            # followed by a table of jumps any instruction after it might be the target.
+            table = label_blocks[target]
+            block.successors.append(table)
+
+            for candidate in blocks[table.index + 1:]:
+                if not is_table_entry(table):
+                    block.successors.append(candidate)
+                elif is_table_entry(candidate):
+                    block.successors.append(candidate)
+                else:
+                    break
+
+            continue
+
+        block.successors.append(label_blocks[target])
+
+        if last.is_call() and following is not None:
+            # the subroutine returns to the instruction after the call.
+            block.successors.append(following)
+
+    return blocks
+
+
+def uses_numeric_addresses(buffer):
+    # an address written as a number could point anywhere, moving or removing anything would break it.
+    for entry in buffer:
+        if isinstance(entry, Instruction) and entry.label_reference() is None:
+            if entry.mnemonic in ("JP", "CALL", "SYS") or (entry.mnemonic == "LD" and entry.words[1].upper() == "I"):
+                if any(word.startswith("0x") for word in entry.words[1:]):
+                    return True
+
+    return False
+
+
+def eliminate_dead_code(buffer, roots=()):
+    """
+    Removes the blocks of code that can't be reached from the start of the program, and the blocks of data that no
+    reachable instruction refers to.
+    :param buffer: list of Label, Instruction and Data entries.
+    :type buffer: list
+    :param roots: labels that are reachable from outside, eg. the global labels of a module other modules may call.
+    :type roots: iterable
+    :return: the new buffer and the removed blocks.
+    :rtype: tuple
+    """
+
+    if not buffer or uses_numeric_addresses(buffer):
+        return buffer, []
+
+    blocks = build_cfg(buffer)
+    if blocks is None:
+        return buffer, []
+
+    label_blocks = {label: block for block in blocks for label in block.labels}
+
+    live = set()
+    pending = [blocks[0]] + [label_blocks[root] for root in roots if root in label_blocks]
+
+    while pending:
+        block = pending.pop()
+        if block.index in live:
+            continue
+        live.add(block.index)
+
+        if block.is_data:
+            continue
+
+        pending += block.successors
+
+        # anything the code refers to without jumping to it (sprites for LD I, ...) is kept as well.
+        for instruction in block.instructions:
+            target = instruction.label_reference()
+            if target in label_blocks:
+                pending.append(label_blocks[target])
+
+    new_buffer = []
+    removed = []
+
+    for block in blocks:
+        if block.index in live:
+            new_buffer += block.entries
+        else:
+            removed.append(block)
+
+    return new_buffer, removed
@@ -0,0 +1,1408 @@
+"""
+Code generation, lowers the trees built by the Parser into the entries of the intermediate buffer.
+
+Every value lives in a V register. An expression is computed straight into the register it's assigned to, values
+that are needed for a while go into scratch registers, which are the registers the program itself never uses. VF is
+the flag register, it's clobbered by most arithmetic and never holds a value.
+
+CHIP-8 has no multiply or divide instructions. Multiplying by a constant is lowered to a chain of SHL, ADD and SUB,
+dividing by a power of two to SHR and the remainder of one to AND. Anything else calls a small runtime helper
+subroutine, which is emitted once at the end of the program.
+
+Loops are inverted: the condition is tested at the bottom of the loop with a single skip and a jump back to the top,
+so every iteration only costs two instructions on top of the body.
+
+Conditions never compute a boolean. == and != map straight onto SE and SNE, < and > subtract into a scratch register
+and skip on the borrow left in VF, and && and || are chains of skips that stop as soon as the result is known. An IF
+whose body is a single instruction puts it right after the skip, without a jump around it.
+
+A SWITCH, or an IF/ELSE IF chain comparing one register with constants, dispatches without comparing every value in
+turn: dense values index a table of jumps with JP V0, nnn, sparse ones go down a binary search tree of comparisons.
+
+& | and ^ map onto AND, OR and XOR, shifting by a constant is a run of SHL or SHR. With superoptimize, assignments
+of short expressions over one or two registers are handed to the superoptimizer (see superopt), which looks for a
+shorter sequence of instructions computing the same value.
+
+The parser hash-conses expressions, so an expression written twice is one node. After computing a node the register
+holding it is remembered, and the next time the node is needed it's copied from there instead of computed again.
+That lasts until the register, or a register the expression reads, is written. Labels and calls forget everything.
+"""
+
+import operator
+
+from .ir import Instruction, Label
+from .parser import BlockNode, ForNode, IfNode, LogicalNode, Node, SwitchNode, WhileNode
+
+REGISTERS = [f"V{number:X}" for number in range(16)]
+
+COMPARISONS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+# the binary operators of expressions, they work on ints and NumPy arrays alike. Results are taken modulo 256.
+OPERATIONS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.floordiv,
+    "%": operator.mod,
+    "&": operator.and_,
+    "|": operator.or_,
+    "^": operator.xor,
+    "<<": operator.lshift,
+    ">>": operator.rshift,
+}
+
+BITWISE_INSTRUCTIONS = {"&": "AND", "|": "OR", "^": "XOR"}
+
+# the operators the superoptimizer knows how to evaluate.
+SUPEROPTIMIZED_OPERATORS = {"+", "-", "&", "|", "^", "<<", ">>"}
+
+# the names of its registers in order of appearance, it's only searched for expressions reading at most two.
+INPUT_NAMES = ("a", "b")
+
+# a < b is the same as b > a.
+SWAPPED_COMPARISONS = {"==": "==", "!=": "!=", "<": ">", "<=": ">=", ">": "<", ">=": "<="}
+
+# Dispatching on fewer cases than this compares them one by one.
+DISPATCH_MIN_CASES = 4
+
+# A jump table has an entry (a JP, 2 bytes) for every value between the lowest and the highest case, a comparison costs
+# an SNE and a JP (4 bytes) per case. Tables are used while they have at most this many entries per case. The index is
+# doubled to step over the entries, so a table can't have more than 128.
+JUMP_TABLE_DENSITY = 2
+JUMP_TABLE_MAX_SIZE = 128
+
+# The binary search compares the values one by one once there are this few left.
+SEARCH_LEAF_SIZE = 3
+
+# Multiplication chains for every constant, see multiplication_chain. Computed on first use.
+_multiplication_chains = {}
+
+
+def multiplication_chain(constant, has_source):
+    """
+    Finds the shortest sequence of instructions multiplying a register by a constant, modulo 256.
+
+    The register starts out holding x. Every step is one instruction: SHL doubles it, ADD/SUB/SUBN combine it with the
+    source register (still holding x, when there is one) or with one temporary register, SAVE copies it to the
+    temporary register and ZERO clears it. A breadth first search over every (value, temporary) state finds the
+    optimal chain for all 256 constants at once, so the search only runs once per process.
+    :param constant: the multiplier, 0 - 255.
+    :type constant: int
+    :param has_source: whether x is still available in another register.
+    :type has_source: bool
+    :return: the steps, as tuples of the operation and the operand slot ("source" or "temp").
+    :rtype: list
+    """
+
+    if has_source not in _multiplication_chains:
+        start = (1, None)
+        parents = {start: None}
+        chains = {}
+        frontier = [start]
+
+        while frontier:
+            next_frontier = []
+
+            for state in frontier:
+                value, temp = state
+                chains.setdefault(value, state)
+
+                slots = []
+                if has_source:
+                    slots.append(("source", 1))
+                if temp is not None:
+                    slots.append(("temp", temp))
+
+                steps = [(("SHL", None), (value * 2 % 256, temp)), (("SAVE", "temp"), (value, value))]
+                if slots:
+                    steps.append((("ZERO", None), (0, temp)))
+                for slot, slot_value in slots:
+                    steps.append((("ADD", slot), ((value + slot_value) % 256, temp)))
+                    steps.append((("SUB", slot), ((value - slot_value) % 256, temp)))
+                    steps.append((("SUBN", slot), ((slot_value - value) % 256, temp)))
+
+                for step, new_state in steps:
+                    if new_state not in parents:
+                        parents[new_state] = (state, step)
+                        next_frontier.append(new_state)
+
+            frontier = next_frontier
+
+        # walk the parents back to the start to get the steps of every chain.
+        _multiplication_chains[has_source] = {}
+        for value, state in chains.items():
+            steps = []
+            while parents[state] is not None:
+                state, step = parents[state]
+                steps.append(step)
+            _multiplication_chains[has_source][value] = steps[::-1]
+
+    return _multiplication_chains[has_source][constant % 256]
+
+
+def is_register(node):
+    return not node.children and isinstance(node.value, str) and node.value[:1] in ("V", "v")
+
+
+def is_number(node):
+    return not node.children and not is_register(node)
+
+
+def register_name(value):
+    """
+    Normalizes a register name, v5 becomes V5 and V10 becomes VA.
+    :rtype: str
+    """
+
+    number = int(value[1:])
+
+    if number > 15:
+        raise ValueError(f"There is no register {value}, the registers are V0 - V15.")
+
+    return REGISTERS[number]
+
+
+def number_value(value):
+    # the lexer gives numbers as hex strings.
+    return int(value, 16) if isinstance(value, str) else value
+
+
+def comparison_values(comparison, constant):
+    # the values x can have for x <comparison> constant to hold.
+    return [value for value in range(256) if COMPARISONS[comparison](value, constant)]
+
+
+def falls_through(code):
+    # whether the code can run into whatever follows it, it doesn't when it ends with a jump or a return.
+    if not code or not isinstance(code[-1], Instruction):
+        return True
+
+    last = code[-1]
+    if not (last.is_return() or (last.is_jump() and not last.is_computed_jump())):
+        return True
+
+    # an instruction right after a skip only runs some of the time.
+    return len(code) > 1 and isinstance(code[-2], Instruction) and code[-2].is_skip()
+
+
+def assigned_registers(node):
+    # every register the statements assign to.
+    if node is None:
+        return set()
+
+    registers = set()
+    if node.value == "=" and is_register(node.children[0]):
+        registers.add(register_name(node.children[0].value))
+
+    for child in node.children:
+        if child is not None:
+            registers |= assigned_registers(child)
+
+    return registers
+
+
+def written_registers(words):
+    """
+    Works out the registers an instruction writes.
+    :param words: the mnemonic and its operands.
+    :type words: tuple
+    :return: the register names, None when it could be any of them (a CALL).
+    :rtype: set
+    """
+
+    mnemonic = words[0]
+    destination = words[1] if len(words) > 1 else None
+
+    if mnemonic == "CALL":
+        return None
+
+    if destination not in REGISTERS:
+        return {"VF"} if mnemonic == "DRW" else set()
+
+    if mnemonic in ("ADD", "SUB", "SUBN", "SHL", "SHR", "OR", "AND", "XOR"):
+        # everything but ADD Vx, kk sets VF, the logical ones reset it on the original interpreter.
+        if mnemonic == "ADD" and words[2] not in REGISTERS:
+            return {destination}
+        return {destination, "VF"}
+
+    if mnemonic == "LD" and len(words) > 2 and words[2] == "[I]":
+        # LD Vx, [I] loads V0 to Vx.
+        return set(REGISTERS[:REGISTERS.index(destination) + 1])
+
+    if mnemonic in ("LD", "RND"):
+        return {destination}
+
+    return set()
+
+
+def registers_in(node):
+    # every register the tree refers to.
+    if is_register(node):
+        return {register_name(node.value)}
+
+    registers = set()
+    for child in node.children:
+        if child is not None:
+            registers |= registers_in(child)
+
+    return registers
+
+
+class CodeGenerator:
+
+    def __init__(self, superoptimize=False):
+        self.buffer = []
+        self.free_registers = []
+        self.helper_registers = None  # the registers the runtime helpers use, reserved on first use.
+        self.helpers = set()  # names of the runtime helpers the program calls.
+        self.label_count = 0
+        self.used_labels = set()  # labels an instruction refers to.
+        self.available = {}  # expression node to the register holding its value, see emit.
+        self.operands = {}  # id of an expression node to the registers it reads.
+        self.superoptimizer = None
+
+        if superoptimize:
+            # NumPy is only needed to superoptimize.
+            from .superopt import Superoptimizer
+            self.superoptimizer = Superoptimizer()
+
+    def generate(self, tree):
+        """
+        Lowers the statements of the parse tree.
+        :param tree: the tree returned by Parser.parse_lines
+        :type tree: Node
+        :return: the intermediate buffer.
+        :rtype: list
+        """
+
+        used = registers_in(tree)
+
+        # scratch registers are handed out from VE down, allocate pops them off the end. V0 goes last, a jump table
+        # needs it.
+        self.free_registers = [register for register in REGISTERS[:-1] if register not in used]
+
+        for statement in tree.children:
+            self.lower_statement(statement)
+
+        # the program ends in an endless loop, so the interpreter never runs into the helpers or whatever follows.
+        end = self.new_label("end")
+        self.emit_label(end)
+        self.emit("JP", f"${end}")
+
+        self.emit_helpers()
+
+        if self.superoptimizer is not None:
+            self.superoptimizer.save()
+
+        return self.buffer
+
+    def emit(self, *words):
+        self.buffer.append(Instruction(words))
+
+        for word in words:
+            if word.startswith("$"):
+                self.used_labels.add(word[1:])
+
+        self.invalidate(written_registers(words))
+
+    def emit_label(self, name):
+        self.buffer.append(Label(name))
+
+        # the code can come from somewhere else, nothing we remember is known to hold there.
+        self.available = {}
+
+    def registers_read(self, node):
+        if id(node) not in self.operands:
+            self.operands[id(node)] = registers_in(node)
+
+        return self.operands[id(node)]
+
+    def invalidate(self, registers):
+        """
+        Forgets the expressions held in the registers, and the expressions reading them.
+        :param registers: the registers written, None for all of them.
+        :type registers: set
+        """
+
+        if registers is None:
+            self.available = {}
+        elif registers and self.available:
+            self.available = {node: register for node, register in self.available.items()
+                              if register not in registers and not registers & self.registers_read(node)}
+
+    def remember(self, node, register):
+        # V1 = V1 + 1 leaves V1 holding something else than V1 + 1.
+        if register not in self.registers_read(node):
+            self.available.setdefault(node, register)
+
+    def emit_label_if_used(self, name):
+        # labels nothing jumps to are left out, they would only split the code for the optimization passes.
+        if name in self.used_labels:
+            self.emit_label(name)
+
+    def lower_detached(self, node):
+        # lowers the statements into a buffer of their own, so we can look at the code before placing it. The code
+        # ends up after code we haven't generated yet, so it can't count on any value computed before.
+        buffer, self.buffer = self.buffer, []
+        available, self.available = self.available, {}
+        self.lower_statement(node)
+
+        code, self.buffer = self.buffer, buffer
+        self.available = available
+        return code
+
+    def new_label(self, name):
+        self.label_count += 1
+        return f"__{name}_{self.label_count}"
+
+    def allocate(self):
+        if not self.free_registers:
+            raise ValueError("Out of scratch registers, the expression is too complex for the registers left over.")
+
+        return self.free_registers.pop()
+
+    def release(self, register):
+        self.free_registers.append(register)
+
+    def immediate(self, value):
+        return f"#{value % 256:02X}"
+
+    def lower_statement(self, node):
+        if isinstance(node, BlockNode):
+            for statement in node.children:
+                self.lower_statement(statement)
+        elif isinstance(node, IfNode):
+            self.lower_if(node)
+        elif isinstance(node, SwitchNode):
+            self.lower_switch(node)
+        elif isinstance(node, WhileNode):
+            self.lower_while(node)
+        elif isinstance(node, ForNode):
+            self.lower_for(node)
+        elif node.value == "=":
+            self.lower_assignment(node)
+
+        # an expression on its own has no effect, there is nothing to generate.
+
+    def lower_assignment(self, node):
+        left, right = node.children
+
+        if not is_register(left):
+            raise ValueError("Only a register can be assigned to.")
+
+        target = register_name(left.value)
+
+        if right.value == "=":
+            # V1 = V2 = 5, assign the inner register first and copy it.
+            self.lower_assignment(right)
+            right = right.children[0]
+
+        if self.superoptimizer is not None:
+            self.lower_superoptimized(right, target)
+        else:
+            self.lower_expression(right, target)
+
+    def fold_constant(self, node, known=None):
+        """
+        Works out the value of an expression made of numbers only.
+        :param known: registers whose value is known at this point, name to value.
+        :type known: dict
+        :return: the value, None when the expression refers to a register.
+        :rtype: int
+        """
+
+        if is_number(node):
+            return number_value(node.value) % 256
+        if is_register(node):
+            return (known or {}).get(register_name(node.value))
+        if len(node.children) != 2:
+            return None
+
+        left, right = (self.fold_constant(child, known) for child in node.children)
+        if left is None or right is None:
+            return None
+
+        if node.value in ("/", "%") and right == 0:
+            raise ZeroDivisionError("Division by zero in a constant expression.")
+
+        return OPERATIONS[node.value](left, right) % 256
+
+    def evaluate(self, node, values):
+        """
+        Computes an expression from the values of its registers.
+        :param values: register name to its value, an int or an array of them.
+        :type values: dict
+        """
+
+        if is_number(node):
+            return number_value(node.value) % 256
+        if is_register(node):
+            return values[register_name(node.value)]
+
+        left, right = (self.evaluate(child, values) for child in node.children)
+
+        if node.value in ("<<", ">>"):
+            # shifting 8 bits or more leaves nothing, the shift count of an array can't be that large.
+            right = min(right, 8)
+
+        return OPERATIONS[node.value](left, right) % 256
+
+    def lower_expression(self, node, target):
+        """
+        Emits the instructions computing an expression into the target register.
+        :param node:
+        :type node: Node
+        :param target: register name, eg. V1
+        :type target: str
+        """
+
+        constant = self.fold_constant(node)
+
+        if constant is not None:
+            self.emit("LD", target, self.immediate(constant))
+            return
+        elif is_register(node):
+            if register_name(node.value) != target:
+                self.emit("LD", target, register_name(node.value))
+            return
+
+        if node in self.available:
+            # computed before and still there.
+            if self.available[node] != target:
+                self.emit("LD", target, self.available[node])
+            return
+
+        if node.value in ("+", "-"):
+            self.lower_additive(node, target)
+        elif node.value == "*":
+            self.lower_multiply(node, target)
+        elif node.value in ("/", "%"):
+            self.lower_divide(node, target)
+        elif node.value in BITWISE_INSTRUCTIONS:
+            self.lower_bitwise(node, target)
+        elif node.value in ("<<", ">>"):
+            self.lower_shift(node, target)
+        else:
+            raise ValueError(f"Operator {node.value} can't be used in an expression.")
+
+        self.remember(node, target)
+
+    def lower_additive(self, node, target):
+        left, right = node.children
+        operator = node.value
+
+        if operator == "+" and self.fold_constant(left) is not None:
+            # addition commutes, keep the constant on the right where ADD Vx, kk can use it.
+            left, right = right, left
+
+        constant = self.fold_constant(right)
+
+        if constant is not None:
+            self.lower_expression(left, target)
+
+            # subtracting a constant is adding its negative.
+            constant = constant if operator == "+" else -constant
+            if constant % 256:
+                self.emit("ADD", target, self.immediate(constant))
+            return
+
+        if operator == "-" and self.fold_constant(left) is not None:
+            # k - x, compute x and subtract it from k with SUBN.
+            self.lower_expression(right, target)
+            temporary = self.allocate()
+            self.emit("LD", temporary, self.immediate(self.fold_constant(left)))
+            self.emit("SUBN", target, temporary)
+            self.release(temporary)
+            return
+
+        operand, temporary = self.operand(left, right, target)
+
+        self.emit("ADD" if operator == "+" else "SUB", target, operand)
+
+        if temporary is not None:
+            self.release(temporary)
+
+    def lower_bitwise(self, node, target):
+        left, right = node.children
+
+        if self.fold_constant(left) is not None:
+            # the bitwise operators commute, keep the constant on the right.
+            left, right = right, left
+
+        constant = self.fold_constant(right)
+
+        if (node.value, constant) in (("&", 0x00), ("|", 0xFF)):
+            # every bit is known.
+            self.emit("LD", target, self.immediate(constant))
+            return
+        if (node.value, constant) in (("&", 0xFF), ("|", 0x00), ("^", 0x00)):
+            self.lower_expression(left, target)
+            return
+
+        operand, temporary = self.operand(left, right, target)
+
+        self.emit(BITWISE_INSTRUCTIONS[node.value], target, operand)
+
+        if temporary is not None:
+            self.release(temporary)
+
+    def lower_shift(self, node, target):
+        left, right = node.children
+        count = self.fold_constant(right)
+
+        if count is None:
+            raise ValueError(f"Only a constant can be the amount of a {node.value} shift.")
+
+        if count >= 8:
+            # every bit is shifted out.
+            self.emit("LD", target, "#00")
+            return
+
+        self.lower_expression(left, target)
+
+        # SHL Vx, Vx shifts Vx on every interpreter, whichever register it thinks is the source.
+        for _ in range(count):
+            self.emit("SHL" if node.value == "<<" else "SHR", target, target)
+
+    def lower_superoptimized(self, node, target):
+        """
+        Lowers an expression, and replaces the code with the sequence the superoptimizer finds if it's shorter.
+        :param node:
+        :type node: Node
+        :param target: register name, eg. V1
+        :type target: str
+        """
+
+        available = dict(self.available)
+        buffer, self.buffer = self.buffer, []
+        self.lower_expression(node, target)
+        code, self.buffer = self.buffer, buffer
+
+        shape = self.expression_shape(node, target)
+        sequence = None
+
+        if shape is not None and code:
+            key, registers, constants = shape
+            sequence = self.superoptimizer.lookup(
+                key, lambda values: self.evaluate(node, dict(zip(registers, values))), len(registers),
+                registers.index(target) if target in registers else None, constants, len(code))
+
+        uses_scratch = sequence is not None and any("s" in words[1:] for words in sequence)
+
+        if sequence is None or (uses_scratch and not self.free_registers):
+            self.buffer += code
+            return
+
+        # the usual code is thrown away, so is what it taught us.
+        self.available = available
+        names = {"t": target, "VF": "VF", **dict(zip(INPUT_NAMES, registers))}
+        if uses_scratch:
+            names["s"] = self.allocate()
+
+        for mnemonic, destination, source in sequence:
+            self.emit(mnemonic, names[destination], names.get(source, source))
+
+        if uses_scratch:
+            self.release(names["s"])
+
+        self.remember(node, target)
+
+    def expression_shape(self, node, target):
+        """
+        Normalizes an expression for the superoptimizer: its registers are named a and b in order of appearance.
+        :return: the shape, the registers in order and the constants, or None when it can't be superoptimized.
+        :rtype: tuple
+        """
+
+        registers = []
+        constants = set()
+
+        def shape(node):
+            if is_register(node):
+                name = register_name(node.value)
+                if name not in registers:
+                    registers.append(name)
+                return INPUT_NAMES[registers.index(name)] if len(registers) <= len(INPUT_NAMES) else None
+            if is_number(node):
+                constants.add(number_value(node.value) % 256)
+                return f"{number_value(node.value) % 256:02X}"
+            if node.value not in SUPEROPTIMIZED_OPERATORS or len(node.children) != 2:
+                return None
+            if node.value in ("<<", ">>") and self.fold_constant(node.children[1]) is None:
+                return None
+
+            left, right = (shape(child) for child in node.children)
+            if left is None or right is None:
+                return None
+
+            return f"({left}{node.value}{right})"
+
+        text = shape(node)
+        if text is None or not registers:
+            return None
+
+        if target in registers:
+            # the target is read by the expression, the sequence starts with its value in t.
+            text = f"t={INPUT_NAMES[registers.index(target)]} {text}"
+        else:
+            text = f"t {text}"
+
+        return text, registers, constants
+
+    def operand(self, left, right, target):
+        """
+        Gets the right hand side of a binary operation into a register, and the left hand side into the target.
+        :return: the register holding the right hand side, and the scratch register to release afterwards.
+        :rtype: tuple
+        """
+
+        if is_register(right):
+            register = register_name(right.value)
+
+            # the right register can be used as is, unless computing the left side overwrites it first.
+            if register != target or (is_register(left) and register_name(left.value) == target):
+                self.lower_expression(left, target)
+                return register, None
+
+        temporary = self.allocate()
+        self.lower_expression(right, temporary)
+        self.lower_expression(left, target)
+
+        return temporary, temporary
+
+    def lower_multiply(self, node, target):
+        left, right = node.children
+
+        if self.fold_constant(left) is not None:
+            left, right = right, left
+
+        constant = self.fold_constant(right)
+
+        if constant is None:
+            self.call_helper("__mul8", left, right, target, result=2)
+            return
+
+        if constant == 0:
+            self.emit("LD", target, "#00")
+            return
+
+        # when x is a register other than the target it's still around to be added.
+        source = register_name(left.value) if is_register(left) and register_name(left.value) != target else None
+
+        chain = multiplication_chain(constant, source is not None)
+
+        if chain and chain[0][0] == "ZERO":
+            # the chain starts from 0 (x * 255 is 0 - x), so x doesn't need to be loaded into the target.
+            chain = chain[1:]
+            self.emit("LD", target, "#00")
+        else:
+            self.lower_expression(left, target)
+
+        temporary = self.allocate() if any(slot == "temp" for _, slot in chain) else None
+        slots = {"source": source, "temp": temporary}
+
+        for operation, slot in chain:
+            if operation == "SHL":
+                # SHL Vx, Vx behaves the same whether the interpreter shifts Vx or Vy.
+                self.emit("SHL", target, target)
+            elif operation == "SAVE":
+                self.emit("LD", temporary, target)
+            elif operation == "ZERO":
+                self.emit("LD", target, "#00")
+            else:
+                self.emit(operation, target, slots[slot])
+
+        if temporary is not None:
+            self.release(temporary)
+
+    def lower_divide(self, node, target):
+        left, right = node.children
+        constant = self.fold_constant(right)
+
+        if constant == 0:
+            raise ZeroDivisionError("Division by zero.")
+
+        if constant is not None and constant & (constant - 1) == 0:
+            # powers of two.
+            self.lower_expression(left, target)
+
+            if node.value == "/":
+                for _ in range(constant.bit_length() - 1):
+                    self.emit("SHR", target, target)
+            elif constant == 1:
+                self.emit("LD", target, "#00")
+            else:
+                temporary = self.allocate()
+                self.emit("LD", temporary, self.immediate(constant - 1))
+                self.emit("AND", target, temporary)
+                self.release(temporary)
+            return
+
+        # the helper leaves the quotient in its third register and the remainder in its first.
+        self.call_helper("__divmod8", left, right, target, result=2 if node.value == "/" else 0)
+
+    def call_helper(self, name, left, right, target, result):
+        """
+        Calls a runtime helper with left and right as its arguments and copies its result to the target.
+        :param name: name of the helper subroutine.
+        :param result: index of the helper register holding the result.
+        """
+
+        if self.helper_registers is None:
+            self.helper_registers = tuple(self.allocate() for _ in range(3))
+
+        first, second, _ = self.helper_registers
+
+        if not self.calls_helper(left):
+            self.lower_expression(right, second)
+            self.lower_expression(left, first)
+        else:
+            # computing the left side calls a helper as well, which would overwrite the right side.
+            temporary = self.allocate()
+            self.lower_expression(right, temporary)
+            self.lower_expression(left, first)
+            self.emit("LD", second, temporary)
+            self.release(temporary)
+
+        self.emit("CALL", f"${name}")
+        self.helpers.add(name)
+
+        if self.helper_registers[result] != target:
+            self.emit("LD", target, self.helper_registers[result])
+
+    def evaluate_condition(self, condition, known=None):
+        """
+        Works out a condition at compile time.
+        :param known: registers whose value is known at this point, name to value.
+        :type known: dict
+        :return: True or False, None when it depends on the registers.
+        :rtype: bool
+        """
+
+        if isinstance(condition, LogicalNode):
+            left, right = (self.evaluate_condition(child, known) for child in condition.children)
+
+            # the value that decides the result on its own, False for && and True for ||.
+            decisive = condition.value == "||"
+            if decisive in (left, right):
+                return decisive
+            if left is None or right is None:
+                return None
+            return not decisive
+
+        if condition.value not in COMPARISONS:
+            return None
+
+        left, right = (self.fold_constant(child, known) for child in condition.children)
+        if left is not None and right is not None:
+            return COMPARISONS[condition.value](left, right)
+
+        # V1 >= 0 always holds, V1 > 255 never does.
+        if right is not None:
+            values = comparison_values(condition.value, right)
+        elif left is not None:
+            values = comparison_values(SWAPPED_COMPARISONS[condition.value], left)
+        else:
+            return None
+
+        if len(values) in (0, 256):
+            return len(values) == 256
+
+        return None
+
+    def register_for(self, node):
+        """
+        Gets the value of an expression into a register, registers are used as they are.
+        :return: the register, and the scratch register to release afterwards.
+        :rtype: tuple
+        """
+
+        if is_register(node):
+            return register_name(node.value), None
+
+        # a scratch register can only be used as is while nobody can allocate it.
+        if node in self.available and self.available[node] not in self.free_registers:
+            return self.available[node], None
+
+        temporary = self.allocate()
+        self.lower_expression(node, temporary)
+        return temporary, temporary
+
+    def emit_skip(self, condition, when):
+        """
+        Emits a skip instruction that skips the next instruction when the condition is `when`, preceded by whatever
+        it takes to get its operands into registers.
+        :param condition: relational node.
+        :type condition: Node
+        :param when: True to skip when the condition holds, False to skip when it doesn't.
+        :type when: bool
+        """
+
+        if condition.value not in COMPARISONS:
+            raise ValueError(f"Operator {condition.value} can't be used in a condition.")
+
+        constant = self.evaluate_condition(condition)
+        if constant is not None:
+            if constant == when:
+                self.emit("SE", "VF", "VF")  # always skips.
+            return
+
+        comparison = condition.value
+        left, right = condition.children
+        if self.fold_constant(left) is not None:
+            left, right = right, left
+            comparison = SWAPPED_COMPARISONS[comparison]
+
+        bound = self.fold_constant(right)
+        if bound is not None and comparison not in ("==", "!="):
+            # a comparison only one value passes or fails is an equality, V1 < 1 is V1 == 0.
+            values = comparison_values(comparison, bound)
+            if len(values) == 1:
+                comparison, bound = "==", values[0]
+            elif len(values) == 255:
+                comparison, bound = "!=", (set(range(256)) - set(values)).pop()
+            right = Node(value=bound)
+
+        if comparison not in ("==", "!="):
+            self.emit_compare_skip(comparison, left, right, when)
+            return
+
+        # SE skips when the operands are equal, SNE when they aren't.
+        mnemonic = "SE" if (comparison == "==") == when else "SNE"
+
+        left_register, left_temporary = self.register_for(left)
+        constant = self.fold_constant(right)
+
+        if constant is not None:
+            self.emit(mnemonic, left_register, self.immediate(constant))
+        else:
+            right_register, right_temporary = self.register_for(right)
+            self.emit(mnemonic, left_register, right_register)
+            if right_temporary is not None:
+                self.release(right_temporary)
+
+        if left_temporary is not None:
+            self.release(left_temporary)
+
+    def emit_compare_skip(self, comparison, left, right, when):
+        """
+        Skips on <, <=, > or >= by subtracting. SUB Vx, Vy sets VF to 1 when Vx >= Vy (no borrow) and to 0 when it
+        borrows, so one subtraction and a skip on VF decides the comparison.
+        """
+
+        # a < b is not a >= b, a > b is not b >= a, a <= b is b >= a.
+        if comparison in (">", "<="):
+            left, right = right, left
+        expected = "#01" if comparison in (">=", "<=") else "#00"
+
+        if is_register(left):
+            left_register = register_name(left.value)
+
+            if is_register(right):
+                temporary = self.allocate()
+                self.emit("LD", temporary, left_register)
+                self.emit("SUB", temporary, register_name(right.value))
+            else:
+                # SUBN Vx, Vy is Vx = Vy - Vx, so the right side doesn't need a copy of the left one.
+                temporary = self.allocate()
+                self.lower_expression(right, temporary)
+                self.emit("SUBN", temporary, left_register)
+
+            self.release(temporary)
+        else:
+            temporary = self.allocate()
+            self.lower_expression(left, temporary)
+            right_register, right_temporary = self.register_for(right)
+            self.emit("SUB", temporary, right_register)
+
+            if right_temporary is not None:
+                self.release(right_temporary)
+            self.release(temporary)
+
+        self.emit("SE" if when else "SNE", "VF", expected)
+
+    def lower_branch(self, condition, label, when):
+        """
+        Jumps to the label when the condition is `when`, falls through otherwise. The right side of && and || is
+        only tested when the left side doesn't decide the result.
+        """
+
+        if isinstance(condition, LogicalNode):
+            left, right = condition.children
+            decisive = condition.value == "||"
+
+            if decisive == when:
+                self.lower_branch(left, label, when)
+                self.lower_branch(right, label, when)
+            else:
+                fall_through = self.new_label("next")
+                self.lower_branch(left, fall_through, decisive)
+                self.lower_branch(right, label, when)
+                self.emit_label_if_used(fall_through)
+            return
+
+        constant = self.evaluate_condition(condition)
+        if constant is not None:
+            if constant == when:
+                self.emit("JP", f"${label}")
+            return
+
+        self.emit_skip(condition, not when)
+        self.emit("JP", f"${label}")
+
+    def lower_skip(self, condition, when, before, after):
+        """
+        Skips the next instruction when the condition is `when`. The left sides of && and || jump straight to the
+        `before` label, placed right before the instruction, or the `after` label, placed right after it.
+        """
+
+        if isinstance(condition, LogicalNode):
+            left, right = condition.children
+            decisive = condition.value == "||"
+
+            # when the left side decides the condition the instruction either runs or is jumped over.
+            self.lower_branch(left, after if decisive == when else before, decisive)
+            self.lower_skip(right, when, before, after)
+            return
+
+        self.emit_skip(condition, when)
+
+    def lower_if(self, node):
+        condition, body, else_body = node.children
+
+        constant = self.evaluate_condition(condition)
+        if constant is not None:
+            taken = body if constant else else_body
+            if taken is not None:
+                self.lower_statement(taken)
+            return
+
+        chain = self.compare_chain(node)
+        if chain is not None and len(chain[1]) >= DISPATCH_MIN_CASES:
+            self.lower_dispatch(*chain)
+            return
+
+        code = self.lower_detached(body)
+        end = self.new_label("endif")
+
+        if else_body is None:
+            if not code:
+                return  # conditions have no side effects.
+
+            if len(code) == 1 and isinstance(code[0], Instruction) and not code[0].is_skip():
+                # the body fits right after the skip, no jump needed.
+                before = self.new_label("then")
+                self.lower_skip(condition, False, before, end)
+                self.emit_label_if_used(before)
+            else:
+                self.lower_branch(condition, end, False)
+
+            self.buffer += code
+            self.emit_label_if_used(end)
+            self.available = {}  # the body may or may not have run.
+            return
+
+        if not code:
+            self.lower_branch(condition, end, True)
+        else:
+            else_label = self.new_label("else")
+            self.lower_branch(condition, else_label, False)
+            self.buffer += code
+
+            if falls_through(code):
+                self.emit("JP", f"${end}")
+            self.emit_label_if_used(else_label)
+
+        self.lower_statement(else_body)
+        self.emit_label_if_used(end)
+
+    def lower_loop(self, condition, body, step=None, known=None):
+        """
+        Emits an inverted loop: the body, then the condition test jumping back to the body.
+
+        The loop is entered with a jump to the test, unless we know the condition holds the first time around.
+        :param known: registers whose value is known before the loop, name to value.
+        :type known: dict
+        """
+
+        always = self.evaluate_condition(condition)
+        at_entry = self.evaluate_condition(condition, known)
+
+        if always is False or at_entry is False:
+            return
+
+        body_label = self.new_label("loop")
+        test_label = self.new_label("loop_test")
+
+        if at_entry is None:
+            self.emit("JP", f"${test_label}")
+
+        self.emit_label(body_label)
+        self.lower_statement(body)
+        if step is not None:
+            self.lower_statement(step)
+
+        if always:
+            self.emit("JP", f"${body_label}")
+        else:
+            self.emit_label(test_label)
+            self.lower_branch(condition, body_label, True)
+
+    def lower_while(self, node):
+        condition, body = node.children
+        self.lower_loop(condition, body)
+
+    def counted_loop(self, node):
+        """
+        Recognizes FOR (Vx = a; Vx <op> b; Vx = Vx + k), with constant a, b and k and a body that doesn't assign to
+        Vx. The values Vx takes are known, so the loop can stop on the exact value Vx has when the condition fails.
+        :return: the register, the step, the exit value and the number of iterations, None if it isn't counted.
+        :rtype: tuple
+        """
+
+        initialization, condition, step, body = node.children
+
+        if initialization is None or initialization.value != "=" or not is_register(initialization.children[0]):
+            return None
+
+        register = register_name(initialization.children[0].value)
+        start = self.fold_constant(initialization.children[1])
+
+        if step is None or step.value != "=" or not is_register(step.children[0]) \
+                or register_name(step.children[0].value) != register:
+            return None
+
+        # the step has to be Vx + k, k + Vx or Vx - k.
+        expression = step.children[1]
+        if expression.value not in ("+", "-") or len(expression.children) != 2:
+            return None
+
+        left, right = expression.children
+        if expression.value == "+" and self.fold_constant(left) is not None:
+            left, right = right, left
+
+        increment = self.fold_constant(right)
+        if not is_register(left) or register_name(left.value) != register or not increment:
+            return None
+        if expression.value == "-":
+            increment = -increment % 256
+
+        # the condition has to compare Vx with a constant.
+        if condition is None or condition.value not in COMPARISONS:
+            return None
+
+        comparison = condition.value
+        left, right = condition.children
+        if self.fold_constant(left) is not None:
+            left, right = right, left
+            comparison = SWAPPED_COMPARISONS[comparison]
+
+        bound = self.fold_constant(right)
+        if start is None or bound is None or not is_register(left) or register_name(left.value) != register:
+            return None
+
+        if register in assigned_registers(body):
+            return None
+
+        value = start
+        iterations = 0
+        while COMPARISONS[comparison](value, bound):
+            value = (value + increment) % 256
+            iterations += 1
+
+            if iterations > 256:
+                return None  # it never ends.
+
+        return register, increment, value, iterations
+
+    def lower_for(self, node):
+        initialization, condition, step, body = node.children
+
+        if initialization is not None:
+            self.lower_statement(initialization)
+
+        counted = self.counted_loop(node)
+
+        if counted is None:
+            known = {}
+            if initialization is not None and initialization.value == "=" and is_register(initialization.children[0]):
+                value = self.fold_constant(initialization.children[1])
+                if value is not None:
+                    known[register_name(initialization.children[0].value)] = value
+
+            self.lower_loop(condition, body, step, known)
+            return
+
+        register, increment, exit_value, iterations = counted
+
+        if iterations == 0:
+            return
+
+        # ADD Vx, kk then compare and skip against the exit value, the body runs at least once.
+        body_label = self.new_label("for")
+        self.emit_label(body_label)
+        self.lower_statement(body)
+        self.emit("ADD", register, self.immediate(increment))
+        self.emit("SE", register, self.immediate(exit_value))
+        self.emit("JP", f"${body_label}")
+
+    def compare_chain(self, node):
+        """
+        Recognizes IF (Vx == a) { } ELSE IF (Vx == b) { } ... ELSE { }, every condition comparing the same register
+        with a constant. The chain stops at the first IF that doesn't, which becomes the default.
+        :return: the register node, the (value, body) cases and the default body, None if the first IF doesn't.
+        :rtype: tuple
+        """
+
+        subject = None
+        cases = []
+        seen = set()
+        default = node
+
+        while isinstance(default, IfNode):
+            condition, body, else_body = default.children
+
+            if condition.value != "==":
+                break
+
+            left, right = condition.children
+            if self.fold_constant(left) is not None:
+                left, right = right, left
+
+            value = self.fold_constant(right)
+            if value is None or not is_register(left):
+                break
+            if subject is not None and register_name(left.value) != register_name(subject.value):
+                break
+
+            subject = left
+            if value not in seen:
+                # a value compared again later never gets there.
+                seen.add(value)
+                cases.append((value, body))
+
+            default = else_body
+            if isinstance(default, BlockNode) and len(default.children) == 1 and isinstance(default.children[0], IfNode):
+                default = default.children[0]  # ELSE IF
+
+        if subject is None:
+            return None
+
+        return subject, cases, default
+
+    def lower_switch(self, node):
+        subject, default = node.children[:2]
+
+        cases = []
+        seen = set()
+
+        for case in node.children[2:]:
+            value = self.fold_constant(case.children[0])
+
+            if value is None:
+                raise ValueError("CASE values must be constants.")
+            if value in seen:
+                raise ValueError(f"CASE {value:#x} appears more than once.")
+
+            seen.add(value)
+            cases.append((value, case.children[1]))
+
+        self.lower_dispatch(subject, cases, default)
+
+    def lower_dispatch(self, subject, cases, default):
+        """
+        Runs the body of the case matching the value of the subject, or the default body when none does.
+        :param subject: the expression dispatched on.
+        :type subject: Node
+        :param cases: (value, body) pairs, the values are all different.
+        :type cases: list
+        :param default: body run when no case matches, or None.
+        :type default: Node
+        """
+
+        constant = self.fold_constant(subject)
+        if constant is not None:
+            body = dict(cases).get(constant, default)
+            if body is not None:
+                self.lower_statement(body)
+            return
+
+        if not cases:
+            if default is not None:
+                self.lower_statement(default)
+            return
+
+        labels = {value: self.new_label("case") for value, body in cases}
+        default_label = self.new_label("default")
+        end = self.new_label("switch_end")
+
+        values = sorted(labels)
+        size = values[-1] - values[0] + 1
+        saved = None
+
+        if len(cases) >= DISPATCH_MIN_CASES and size <= min(JUMP_TABLE_MAX_SIZE, JUMP_TABLE_DENSITY * len(cases)):
+            saved = self.emit_jump_table(subject, labels, default_label)
+        else:
+            register, temporary = self.register_for(subject)
+            self.emit_search(register, values, labels, default_label)
+
+            if temporary is not None:
+                self.release(temporary)
+
+        # every case starts with V0 restored, if the jump table needed it. The register holding it can be reused by
+        # the bodies, only the dispatch code runs before a restore.
+        if saved is not None:
+            self.release(saved)
+
+        for count, (value, body) in enumerate(cases):
+            self.emit_label(labels[value])
+            if saved is not None:
+                self.emit("LD", "V0", saved)
+
+            start = len(self.buffer)
+            self.lower_statement(body)
+
+            is_last = count == len(cases) - 1
+            if falls_through(self.buffer[start:]) and not (is_last and saved is None and default is None):
+                self.emit("JP", f"${end}")
+
+        self.emit_label(default_label)
+        if saved is not None:
+            self.emit("LD", "V0", saved)
+        if default is not None:
+            self.lower_statement(default)
+
+        self.emit_label_if_used(end)
+
+    def emit_jump_table(self, subject, labels, default_label):
+        """
+        Dispatches through a table of jumps: V0 = (subject - lowest value) * 2 indexes it with JP V0, table. Values
+        outside the table go to the default.
+        :return: the register V0 was saved in, None when the program doesn't use V0.
+        :rtype: str
+        """
+
+        values = sorted(labels)
+        lowest = values[0]
+        size = values[-1] - lowest + 1
+
+        saved = None
+        if "V0" in self.free_registers:
+            self.free_registers.remove("V0")
+        else:
+            saved = self.allocate()
+            self.emit("LD", saved, "V0")
+
+        self.lower_expression(subject, "V0")
+        if lowest:
+            self.emit("ADD", "V0", self.immediate(-lowest))
+
+        if size < 256:
+            # values below the lowest one wrapped around, so one unsigned comparison checks both ends.
+            bound = self.allocate()
+            self.emit("LD", bound, self.immediate(size))
+            self.emit("SUBN", bound, "V0")
+            self.release(bound)
+            self.emit("SE", "VF", "#00")
+            self.emit("JP", f"${default_label}")
+
+        table = self.new_label("jump_table")
+        self.emit("SHL", "V0", "V0")
+        self.emit("JP", "V0", f"${table}")
+
+        self.emit_label(table)
+        for value in range(lowest, lowest + size):
+            self.emit("JP", f"${labels.get(value, default_label)}")
+
+        if saved is None:
+            self.free_registers.append("V0")
+
+        return saved
+
+    def emit_search(self, register, values, labels, default_label):
+        """
+        Dispatches with a binary search: every comparison halves the values that are left, the last few are compared
+        one by one.
+        :param register: holds the subject.
+        :param values: the values left, sorted.
+        :type values: list
+        """
+
+        if len(values) <= SEARCH_LEAF_SIZE:
+            for value in values:
+                self.emit("SNE", register, self.immediate(value))
+                self.emit("JP", f"${labels[value]}")
+            self.emit("JP", f"${default_label}")
+            return
+
+        middle = len(values) // 2
+        below = self.new_label("search")
+
+        # SUBN leaves VF set when the subject is at least the middle value.
+        temporary = self.allocate()
+        self.emit("LD", temporary, self.immediate(values[middle]))
+        self.emit("SUBN", temporary, register)
+        self.release(temporary)
+        self.emit("SE", "VF", "#01")
+        self.emit("JP", f"${below}")
+
+        self.emit_search(register, values[middle:], labels, default_label)
+        self.emit_label(below)
+        self.emit_search(register, values[:middle], labels, default_label)
+
+    def calls_helper(self, node):
+        if self.fold_constant(node) is not None or is_register(node):
+            return False
+
+        left, right = node.children
+        if node.value == "*" and self.fold_constant(left) is None and self.fold_constant(right) is None:
+            return True
+        if node.value in ("/", "%"):
+            constant = self.fold_constant(right)
+            if constant is None or constant & (constant - 1) != 0:
+                return True
+
+        return self.calls_helper(left) or self.calls_helper(right)
+
+    def emit_helpers(self):
+        if self.helper_registers is None:
+            return
+
+        first, second, third = self.helper_registers
+
+        if "__mul8" in self.helpers:
+            # third = first * second, shift and add. Clobbers first, second and VF.
+            self.emit_label("__mul8")
+            self.emit("LD", third, "#00")
+            self.emit_label("__mul8_loop")
+            self.emit("SNE", second, "#00")
+            self.emit("RET")
+            self.emit("SHR", second, second)
+            self.emit("SE", "VF", "#00")
+            self.emit("ADD", third, first)
+            self.emit("SHL", first, first)
+            self.emit("JP", "$__mul8_loop")
+
+        if "__divmod8" in self.helpers:
+            # third = first / second and first = first % second, by repeated subtraction. Clobbers VF.
+            # Dividing by zero gives 0 and leaves first as it is.
+            self.emit_label("__divmod8")
+            self.emit("LD", third, "#00")
+            self.emit("SNE", second, "#00")
+            self.emit("RET")
+            self.emit_label("__divmod8_loop")
+            self.emit("SUB", first, second)
+            self.emit("SNE", "VF", "#00")
+            self.emit("JP", "$__divmod8_done")
+            self.emit("ADD", third, "#01")
+            self.emit("JP", "$__divmod8_loop")
+            self.emit_label("__divmod8_done")
+            self.emit("ADD", first, second)
+            self.emit("RET")
@@ -0,0 +1,191 @@
+"""
+Data size optimization: labeled blocks of data are stored as few bytes as possible.
+
+A block is the data following a label, up to the next label or instruction. Blocks with the same bytes are stored
+once, a block found inside another one becomes a label into it, and blocks where the end of one is the start of the
+other are merged so the shared bytes are stored once. The packed blocks are placed together at the end of the
+program, every label pointing at the right offset.
+
+Code has to refer to a block through its own label: indexing from one label into the block that happens to follow it
+in the source no longer works once the blocks have moved.
+"""
+
+from .cfg import uses_numeric_addresses
+from .ir import Data, Label
+
+
+class DataBlock:
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.contents = bytearray()
+
+    def __repr__(self):
+        return f"DataBlock({self.labels}, {len(self.contents)} bytes)"
+
+
+def collect_blocks(buffer):
+    """
+    Takes the labeled data blocks out of the buffer.
+    :param buffer: list of Label, Instruction and Data entries.
+    :type buffer: list
+    :return: the buffer without them, the blocks, and the labels at the very end of the buffer.
+    :rtype: tuple
+    """
+
+    remaining = []
+    blocks = []
+    labels = []  # labels we haven't seen the next entry of yet.
+    block = None
+
+    for entry in buffer:
+        if isinstance(entry, Label):
+            labels.append(entry)
+            block = None
+            continue
+
+        if isinstance(entry, Data):
+            if labels:
+                block = DataBlock([label.name for label in labels])
+                blocks.append(block)
+                labels = []
+
+            if block is not None:
+                block.contents += entry.payload
+                continue
+
+        # instructions, and data nothing refers to, stay where they are.
+        remaining += labels
+        remaining.append(entry)
+        labels = []
+        block = None
+
+    return remaining, blocks, labels
+
+
+def overlap(first, second):
+    # the length of the longest end of first that is also the start of second.
+    for length in range(min(len(first), len(second)) - 1, 0, -1):
+        if first.endswith(second[:length]):
+            return length
+
+    return 0
+
+
+def pack_strings(strings):
+    """
+    Packs strings into as few bytes as it can, so every string is found somewhere in the result. Strings inside
+    another one are found there, the rest are merged greedily on their largest overlaps.
+    :param strings: list of bytes, without duplicates.
+    :type strings: list
+    :return: the packed storage, and the offset of every string in it.
+    :rtype: tuple
+    """
+
+    # longest first, so a string is only looked for in strings at least as long.
+    order = sorted(range(len(strings)), key=lambda index: -len(strings[index]))
+
+    kept = []
+    inside = {}  # string index to (index of the string containing it, offset)
+
+    for index in order:
+        for other in kept:
+            offset = strings[other].find(strings[index])
+            if offset != -1:
+                inside[index] = (other, offset)
+                break
+        else:
+            kept.append(index)
+
+    # greedy merging, the pairs with the largest overlaps first. Every string gets at most one successor and one
+    # predecessor, and the chains must not close into a cycle.
+    pairs = sorted(((overlap(strings[first], strings[second]), first, second)
+                    for first in kept for second in kept if first != second), reverse=True)
+
+    successor = {}
+    predecessor = {}
+    chain_of = {index: index for index in kept}
+
+    def chain(index):
+        while chain_of[index] != index:
+            chain_of[index] = chain_of[chain_of[index]]
+            index = chain_of[index]
+        return index
+
+    for length, first, second in pairs:
+        if length == 0:
+            break
+        if first in successor or second in predecessor or chain(first) == chain(second):
+            continue
+
+        successor[first] = (second, length)
+        predecessor[second] = first
+        chain_of[chain(second)] = chain(first)
+
+    storage = bytearray()
+    offsets = {}
+
+    for index in kept:
+        if index in predecessor:
+            continue
+
+        # walk the chain from its first string.
+        offsets[index] = len(storage)
+        storage += strings[index]
+
+        while index in successor:
+            index, length = successor[index]
+            offsets[index] = len(storage) - length
+            storage += strings[index][length:]
+
+    for index, (other, offset) in inside.items():
+        offsets[index] = offsets[other] + offset
+
+    return bytes(storage), offsets
+
+
+def pack_data(buffer):
+    """
+    Removes duplicate and overlapping bytes from the labeled data blocks.
+    :param buffer: list of Label, Instruction and Data entries.
+    :type buffer: list
+    :return: the new buffer and the number of bytes saved.
+    :rtype: tuple
+    """
+
+    if uses_numeric_addresses(buffer):
+        # data at a numeric address can't be moved.
+        return buffer, 0
+
+    remaining, blocks, trailing = collect_blocks(buffer)
+    if not blocks:
+        return buffer, 0
+
+    # blocks with the same bytes share one string.
+    strings = []
+    string_of = {}
+    for block in blocks:
+        contents = bytes(block.contents)
+        if contents not in string_of:
+            string_of[contents] = len(strings)
+            strings.append(contents)
+
+    storage, offsets = pack_strings(strings)
+
+    # labels by offset in the storage, the storage is split wherever a label points.
+    labels_at = {}
+    for block in blocks:
+        labels_at.setdefault(offsets[string_of[bytes(block.contents)]], []).extend(block.labels)
+
+    packed = []
+    boundaries = sorted(labels_at) + [len(storage)]
+
+    for count, offset in enumerate(boundaries[:-1]):
+        packed += [Label(name) for name in labels_at[offset]]
+        if boundaries[count + 1] > offset:
+            packed.append(Data(storage[offset:boundaries[count + 1]]))
+
+    saved = sum(len(block.contents) for block in blocks) - len(storage)
+
+    # labels at the end still point past everything.
+    return remaining + packed + trailing, saved
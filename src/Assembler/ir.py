@@ -0,0 +1,110 @@
+"""
+The intermediate representation the assembler passes work on.
+
+The first pass turns the source into a flat list of labels, instructions and data. Optimization passes rewrite that
+list while every address is still symbolic, and only then is every label given its final address.
+"""
+
+# The interpreter loads programs at 0x200 and everything has to fit below 0x1000.
+PROGRAM_START = 0x200
+MEMORY_SIZE = 0x1000
+
+SKIP_MNEMONICS = {"SE", "SNE", "SKP", "SKNP"}
+
+
+class Label:
+
+    def __init__(self, name):
+        self.name = name
+
+    def __len__(self):
+        return 0
+
+    def __repr__(self):
+        return f"Label({repr(self.name)})"
+
+
+class Instruction:
+
+    def __init__(self, words):
+        self.words = list(words)  # the mnemonic followed by its operands, labels are referenced as $name.
+
+    @property
+    def mnemonic(self):
+        return self.words[0].upper()
+
+    def label_reference(self):
+        # returns the name of the label this instruction refers to, if it refers to one.
+        for word in self.words[1:]:
+            if word.startswith("$"):
+                return word[1:]
+        return None
+
+    def is_skip(self):
+        return self.mnemonic in SKIP_MNEMONICS
+
+    def is_jump(self):
+        return self.mnemonic == "JP"
+
+    def is_computed_jump(self):
+        # JP V0, nnn jumps to nnn + V0.
+        return self.is_jump() and self.words[1].upper() == "V0" and len(self.words) > 2
+
+    def is_call(self):
+        return self.mnemonic == "CALL"
+
+    def is_return(self):
+        return self.mnemonic == "RET"
+
+    def is_control_flow(self):
+        return self.is_skip() or self.is_jump() or self.is_call() or self.is_return() or self.mnemonic == "SYS"
+
+    def __len__(self):
+        return 2
+
+    def __repr__(self):
+        return f"Instruction({repr(' '.join(self.words))})"
+
+
+class Data:
+
+    def __init__(self, payload, origin=None):
+        self.payload = payload  # bytes, or a memoryview of a mapped file.
+        self.origin = origin  # the directive the data comes from, for error messages.
+
+    def __len__(self):
+        return len(self.payload)
+
+    def __repr__(self):
+        return f"Data({len(self.payload)} bytes)"
+
+
+def layout(buffer, origin=PROGRAM_START):
+    """
+    Gives every label in the buffer its address.
+    :param buffer: list of Label, Instruction and Data entries.
+    :type buffer: list
+    :param origin: address of the first entry.
+    :type origin: int
+    :return: label name to address.
+    :rtype: dict
+    """
+
+    label_table = dict()
+    address = origin
+
+    for entry in buffer:
+        if isinstance(entry, Label):
+            if entry.name in label_table:
+                raise ValueError(f"Label {entry.name} is declared more than once.")
+            label_table[entry.name] = address
+
+        if address + len(entry) > MEMORY_SIZE:
+            # only known now, passes like the jump to the first instruction move everything after them.
+            where = getattr(entry, "origin", None) or repr(entry)
+            raise ValueError(f"{where} does not fit in memory, it would end at {hex(address + len(entry) - 1)} "
+                             f"which is past {hex(MEMORY_SIZE - 1)}.")
+
+        address += len(entry)
+
+    return label_table
@@ -0,0 +1,93 @@
+"""
+Links object files into a ROM image.
+
+The code sections of the modules are placed one after the other from 0x200, in the order the modules are given, so
+the first module is the one the interpreter starts running. The data sections follow all the code. Every symbol then
+has its address, and the relocations of every module are patched with the address of the symbol they refer to.
+"""
+
+from .ir import MEMORY_SIZE, PROGRAM_START
+from .objectfile import ObjectFile
+
+
+def link(objects, origin=PROGRAM_START):
+    """
+    Links object files into one image.
+    :param objects: the modules, the first one holds the entry point.
+    :type objects: list
+    :param origin: the address the image is loaded at.
+    :type origin: int
+    :return: the image and the address of every global symbol.
+    :rtype: tuple
+    """
+
+    # place the sections: all the code first, then all the data.
+    bases = [[0, 0] for _ in objects]
+    address = origin
+
+    for section in range(2):
+        for count, object_file in enumerate(objects):
+            bases[count][section] = address
+            address += len(object_file.sections[section])
+
+    if address > MEMORY_SIZE:
+        raise ValueError(f"Linked program is {address - origin} bytes, it does not fit in memory "
+                         f"({MEMORY_SIZE - origin} bytes available).")
+
+    # resolve the symbols, global ones are visible to every module.
+    global_symbols = {}
+    definers = {}
+
+    for count, object_file in enumerate(objects):
+        for symbol in object_file.symbols:
+            if not symbol.is_defined or not symbol.is_global:
+                continue
+
+            if symbol.name in global_symbols:
+                raise ValueError(f"Symbol {symbol.name} is defined in both {definers[symbol.name]} and "
+                                 f"{object_file.name}.")
+
+            global_symbols[symbol.name] = bases[count][symbol.section] + symbol.offset
+            definers[symbol.name] = object_file.name
+
+    # lay out the image and patch the nnn field of every relocated instruction.
+    sections = [[bytearray(object_file.sections[section]) for object_file in objects] for section in range(2)]
+
+    for count, object_file in enumerate(objects):
+        for relocation in object_file.relocations:
+            symbol = object_file.symbols[relocation.symbol]
+
+            if symbol.is_defined:
+                target = bases[count][symbol.section] + symbol.offset
+            elif symbol.name in global_symbols:
+                target = global_symbols[symbol.name]
+            else:
+                raise ValueError(f"Undefined symbol {symbol.name}, referred to by {object_file.name}.")
+
+            section = sections[relocation.section][count]
+            word = int.from_bytes(section[relocation.offset:relocation.offset + 2], "big")
+            section[relocation.offset:relocation.offset + 2] = ((word & 0xF000) | target).to_bytes(2, "big")
+
+    image = bytearray()
+    for section in sections:
+        for contents in section:
+            image += contents
+
+    return image, global_symbols
+
+
+def link_files(file_names, output="output.c8"):
+    """
+    Links object files on disk and writes the ROM image.
+    :param file_names: the object files, the first one holds the entry point.
+    :type file_names: list
+    :param output: the ROM file to write.
+    :type output: str
+    """
+
+    image, symbols = link([ObjectFile.read(file_name) for file_name in file_names])
+
+    print(f"Linked {len(file_names)} modules, {len(image)} bytes, {len(symbols)} global symbols")
+
+    with open(output, "wb") as file:
+        file.write(image)
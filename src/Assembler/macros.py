@@ -0,0 +1,193 @@
+"""
+The .macro and .rept directives of the assembly front-end.
+
+    .macro name param ...        .rept count [counter]
+    ...  \\param  ...              ...  \\counter  ...
+    .endm                        .endr
+
+A macro body is split into words and parsed once, when it's defined. Expanding it substitutes the arguments for the
+\\param words and unrolls the .rept blocks inside it, and the result is kept per argument list, so using a macro a
+thousand times with the same arguments expands it once. Macros used inside a macro body are left as they are in the
+expansion and expanded when it's added to the program, with their own cache.
+
+\\@ is replaced with a number unique to every expansion, for labels inside a macro. The counter of a .rept is the
+number of the repetition, written in hex so it can be used in a register name (V\\i) or an immediate (#\\i).
+"""
+
+# A macro using itself would never stop expanding.
+MAX_EXPANSION_DEPTH = 64
+
+
+class Repeat:
+
+    def __init__(self, count, counter, body):
+        self.count = count  # the word giving the number of repetitions, it may be a macro parameter.
+        self.counter = counter  # name of the repetition number, or None.
+        self.body = body
+
+    def __repr__(self):
+        return f"Repeat({self.count}, {len(self.body)} lines)"
+
+
+class Macro:
+
+    def __init__(self, name, parameters, body):
+        self.name = name
+        self.parameters = parameters
+        self.body = body  # word tuples and Repeats, see parse_block.
+        self.expansions = {}  # arguments to the expanded word tuples.
+        self.uses_counter = contains(body, "\\@")
+
+    def expand(self, arguments, parse_number):
+        """
+        Expands the macro, an expansion is only worked out the first time its arguments are used.
+        :param arguments: the words the parameters are replaced with.
+        :type arguments: list
+        :param parse_number: parses the count of a .rept.
+        :return: the word tuples of the expansion, with \\@ left in.
+        :rtype: list
+        """
+
+        key = tuple(arguments)
+
+        if key not in self.expansions:
+            if len(arguments) != len(self.parameters):
+                raise ValueError(f"Macro {self.name} takes {len(self.parameters)} arguments, "
+                                 f"{len(arguments)} were given.")
+
+            self.expansions[key] = unroll(self.body, dict(zip(self.parameters, arguments)), parse_number)
+
+        return self.expansions[key]
+
+    def __repr__(self):
+        return f"Macro({repr(self.name)}, {self.parameters}, {len(self.expansions)} expansions)"
+
+
+def contains(items, text):
+    # whether a word of the parsed block contains the text.
+    for item in items:
+        if isinstance(item, Repeat):
+            if text in item.count or contains(item.body, text):
+                return True
+        elif any(text in word for word in item):
+            return True
+
+    return False
+
+
+def read_block(lines, start, opening, closing):
+    """
+    Finds the end of a block, nested blocks of the same kind included.
+    :param lines: the source, split into words.
+    :type lines: list
+    :param start: index of the first line of the body.
+    :param opening: .macro or .rept
+    :param closing: .endm or .endr
+    :return: the lines of the body, and the index of the line after the closing one.
+    :rtype: tuple
+    """
+
+    depth = 1
+
+    for count in range(start, len(lines)):
+        words = lines[count]
+        if not words:
+            continue
+
+        if words[0] == opening:
+            depth += 1
+        elif words[0] == closing:
+            depth -= 1
+            if depth == 0:
+                return lines[start:count], count + 1
+
+    raise ValueError(f"{opening} without a matching {closing}.")
+
+
+def parse_block(lines):
+    """
+    Parses the lines of a block once: every line becomes a tuple of words, and .rept blocks a Repeat.
+    :param lines: the lines, split into words.
+    :type lines: list
+    :rtype: list
+    """
+
+    items = []
+    count = 0
+
+    while count < len(lines):
+        words = lines[count]
+        count += 1
+
+        if not words:
+            continue
+
+        if words[0] == ".rept":
+            if len(words) not in (2, 3):
+                raise ValueError(".rept directive is invalid.")
+
+            body, count = read_block(lines, count, ".rept", ".endr")
+            items.append(Repeat(words[1], words[2] if len(words) > 2 else None, parse_block(body)))
+        elif words[0] == ".macro":
+            raise ValueError(f"Macro {words[1] if len(words) > 1 else ''} can't be defined inside a macro or .rept.")
+        elif words[0] in (".endm", ".endr"):
+            raise ValueError(f"{words[0]} without a matching {'.macro' if words[0] == '.endm' else '.rept'}.")
+        else:
+            items.append(tuple(words))
+
+    return items
+
+
+def substitute(words, replacements):
+    """
+    Replaces \\name with its value in every word.
+    :param words:
+    :type words: tuple
+    :param replacements: name to value, longest names first so \\x doesn't replace the start of \\xy.
+    :type replacements: list
+    :rtype: tuple
+    """
+
+    if not any("\\" in word for word in words):
+        return words
+
+    result = []
+    for word in words:
+        if "\\" in word:
+            for name, value in replacements:
+                word = word.replace("\\" + name, value)
+        result.append(word)
+
+    return tuple(result)
+
+
+def unroll(items, values, parse_number):
+    """
+    Substitutes the values and unrolls the .rept blocks of a parsed block.
+    :param items: word tuples and Repeats.
+    :type items: list
+    :param values: parameter or counter name to the word replacing it.
+    :type values: dict
+    :param parse_number: parses the count of a .rept.
+    :return: word tuples.
+    :rtype: list
+    """
+
+    replacements = sorted(values.items(), key=lambda item: -len(item[0]))
+    result = []
+
+    for item in items:
+        if not isinstance(item, Repeat):
+            result.append(substitute(item, replacements))
+            continue
+
+        count = parse_number(substitute((item.count,), replacements)[0])
+
+        if item.counter is None:
+            # every repetition is the same, it's only worked out once.
+            result += unroll(item.body, values, parse_number) * count
+        else:
+            for index in range(count):
+                result += unroll(item.body, {**values, item.counter: f"{index:X}"}, parse_number)
+
+    return result
@@ -0,0 +1,206 @@
+"""
+Relocatable object files, the output of assembling one module with compile only.
+
+A module is encoded with every label reference left as 0 and a relocation entry recording which word needs the
+address of which symbol. The linker places the sections of every module, resolves the symbols and patches the
+words. Only the nnn field of JP, CALL, LD I and JP V0 can refer to a label, so there is a single kind of relocation:
+the low 12 bits of a big endian instruction word.
+
+Labels starting with __ are local to their module (the generated ones, __end_1, __mul8, ...), every other
+label is global. A label the module refers to but doesn't declare is an undefined symbol, the linker looks it up in
+the other modules.
+
+File layout, big endian:
+
+    magic "C8OB", version (1 byte)
+    code length (2 bytes), code bytes
+    data length (2 bytes), data bytes
+    symbol count (2 bytes), then per symbol:
+        name length (1 byte), name (utf-8), section (1 byte, 0 code, 1 data, 0xFF undefined), offset (2 bytes),
+        global (1 byte)
+    relocation count (2 bytes), then per relocation:
+        section (1 byte), offset (2 bytes), symbol index (2 bytes)
+"""
+
+import struct
+
+from .ir import Data, Instruction, Label
+
+MAGIC = b"C8OB"
+VERSION = 1
+
+SECTIONS = ("code", "data")
+UNDEFINED = 0xFF
+
+# Instructions whose nnn field can hold the address of a label.
+RELOCATABLE_MNEMONICS = {"JP", "CALL", "LD"}
+
+
+class Symbol:
+
+    def __init__(self, name, section=None, offset=0, is_global=True):
+        self.name = name
+        self.section = section  # index into SECTIONS, None when the module only refers to it.
+        self.offset = offset
+        self.is_global = is_global
+
+    @property
+    def is_defined(self):
+        return self.section is not None
+
+    def __repr__(self):
+        where = f"{SECTIONS[self.section]}+{self.offset:#x}" if self.is_defined else "undefined"
+        return f"Symbol({repr(self.name)}, {where}, {'global' if self.is_global else 'local'})"
+
+
+class Relocation:
+
+    def __init__(self, section, offset, symbol):
+        self.section = section
+        self.offset = offset  # of the instruction word in the section.
+        self.symbol = symbol  # index into the symbol table.
+
+    def __repr__(self):
+        return f"Relocation({SECTIONS[self.section]}+{self.offset:#x}, symbol {self.symbol})"
+
+
+class ObjectFile:
+
+    def __init__(self, name="<module>"):
+        self.name = name  # used in link errors.
+        self.sections = [bytearray(), bytearray()]  # code, data
+        self.symbols = []
+        self.relocations = []
+
+    def symbol_index(self, name):
+        for count, symbol in enumerate(self.symbols):
+            if symbol.name == name:
+                return count
+
+        self.symbols.append(Symbol(name, is_global=not name.startswith("__")))
+        return len(self.symbols) - 1
+
+    def write(self, file_name):
+        contents = bytearray(MAGIC)
+        contents += struct.pack(">B", VERSION)
+
+        for section in self.sections:
+            contents += struct.pack(">H", len(section))
+            contents += section
+
+        contents += struct.pack(">H", len(self.symbols))
+        for symbol in self.symbols:
+            name = symbol.name.encode("utf-8")
+            if len(name) > 0xFF:
+                raise ValueError(f"Symbol {symbol.name} is too long for an object file, names are at most 255 bytes "
+                                 f"of UTF-8.")
+
+            section = UNDEFINED if symbol.section is None else symbol.section
+            contents += struct.pack(">B", len(name)) + name
+            contents += struct.pack(">BHB", section, symbol.offset, symbol.is_global)
+
+        contents += struct.pack(">H", len(self.relocations))
+        for relocation in self.relocations:
+            contents += struct.pack(">BHH", relocation.section, relocation.offset, relocation.symbol)
+
+        with open(file_name, "wb") as file:
+            file.write(contents)
+
+    @classmethod
+    def read(cls, file_name):
+        with open(file_name, "rb") as file:
+            contents = file.read()
+
+        if contents[:4] != MAGIC:
+            raise ValueError(f"{file_name} is not an object file.")
+        if contents[4] != VERSION:
+            raise ValueError(f"{file_name} is an object file of version {contents[4]}, expected {VERSION}.")
+
+        object_file = cls(file_name)
+        position = 5
+
+        def unpack(fmt):
+            nonlocal position
+            values = struct.unpack_from(fmt, contents, position)
+            position += struct.calcsize(fmt)
+            return values
+
+        for count in range(len(SECTIONS)):
+            length, = unpack(">H")
+            object_file.sections[count] = bytearray(contents[position:position + length])
+            position += length
+
+        symbol_count, = unpack(">H")
+        for count in range(symbol_count):
+            length, = unpack(">B")
+            name = contents[position:position + length].decode("utf-8")
+            position += length
+            section, offset, is_global = unpack(">BHB")
+
+            object_file.symbols.append(Symbol(name, None if section == UNDEFINED else section, offset,
+                                              bool(is_global)))
+
+        relocation_count, = unpack(">H")
+        for count in range(relocation_count):
+            object_file.relocations.append(Relocation(*unpack(">BHH")))
+
+        return object_file
+
+    def __repr__(self):
+        return f"ObjectFile({repr(self.name)}, code {len(self.sections[0])} bytes, data {len(self.sections[1])} " \
+               f"bytes, {len(self.symbols)} symbols, {len(self.relocations)} relocations)"
+
+
+def build_object(buffer, fetch_opcode, name="<module>"):
+    """
+    Encodes an intermediate buffer into an object file. Instructions go to the code section and data to the data
+    section, in the order they come in, a label belongs to the entry that follows it.
+    :param buffer: list of Label, Instruction and Data entries.
+    :type buffer: list
+    :param fetch_opcode: encodes the words of an instruction into an opcode hex string.
+    :param name: the module name, used in link errors.
+    :rtype: ObjectFile
+    """
+
+    object_file = ObjectFile(name)
+    code, data = object_file.sections
+    pending_labels = []
+
+    def define(labels, section, offset):
+        for label in labels:
+            symbol = object_file.symbols[object_file.symbol_index(label)]
+            if symbol.is_defined:
+                raise ValueError(f"Label {label} is declared more than once.")
+            symbol.section = section
+            symbol.offset = offset
+
+    for entry in buffer:
+        if isinstance(entry, Label):
+            pending_labels.append(entry.name)
+
+        elif isinstance(entry, Data):
+            define(pending_labels, 1, len(data))
+            pending_labels = []
+            data += entry.payload
+
+        elif isinstance(entry, Instruction):
+            define(pending_labels, 0, len(code))
+            pending_labels = []
+
+            words = list(entry.words)
+            reference = entry.label_reference()
+
+            if reference is not None:
+                if entry.mnemonic not in RELOCATABLE_MNEMONICS:
+                    raise ValueError(f"{' '.join(entry.words)} can't refer to a label.")
+
+                # the address is filled in by the linker.
+                words = ["0x000" if word.startswith("$") else word for word in words]
+                object_file.relocations.append(Relocation(0, len(code), object_file.symbol_index(reference)))
+
+            code += bytes.fromhex(fetch_opcode(words).zfill(4))
+
+    # labels at the very end point past the last instruction.
+    define(pending_labels, 0, len(code))
+
+    return object_file
@@ -0,0 +1,341 @@
+"""
+Code size optimization: repeated instruction sequences are moved into one shared subroutine and every copy is
+replaced by a CALL to it.
+
+Repeats are found with a suffix array over the instruction stream. Only straight line code is extracted, a sequence
+never contains control flow, never has a label inside it and never starts right after a skip, so the program behaves
+exactly the same, it just spends one extra stack level while the subroutine runs.
+"""
+
+from .ir import Data, Instruction, Label
+
+# The CHIP-8 stack holds 16 return addresses.
+MAX_STACK_DEPTH = 16
+
+
+def suffix_array(sequence):
+    """
+    Builds the suffix array of a sequence of integers by prefix doubling.
+    :param sequence:
+    :type sequence: list
+    :return: the start positions of the suffixes in sorted order.
+    :rtype: list
+    """
+
+    length = len(sequence)
+    if length == 0:
+        return []
+
+    # rank the single symbols, then keep doubling the length of the prefix each suffix is sorted on.
+    symbols = {symbol: rank for rank, symbol in enumerate(sorted(set(sequence)))}
+    ranks = [symbols[symbol] for symbol in sequence]
+    suffixes = list(range(length))
+    step = 1
+
+    while True:
+        def key(index):
+            return ranks[index], ranks[index + step] if index + step < length else -1
+
+        suffixes.sort(key=key)
+
+        new_ranks = [0] * length
+        for count in range(1, length):
+            new_ranks[suffixes[count]] = new_ranks[suffixes[count - 1]] + (key(suffixes[count]) != key(suffixes[count - 1]))
+        ranks = new_ranks
+
+        if ranks[suffixes[-1]] == length - 1:
+            return suffixes
+
+        step *= 2
+
+
+def lcp_array(sequence, suffixes):
+    """
+    Kasai's algorithm, lcp[i] is the length of the common prefix of the suffixes at i - 1 and i in the suffix array.
+    :rtype: list
+    """
+
+    length = len(sequence)
+    rank = [0] * length
+    for count, suffix in enumerate(suffixes):
+        rank[suffix] = count
+
+    lcp = [0] * length
+    common = 0
+
+    for index in range(length):
+        if rank[index] == 0:
+            common = 0
+            continue
+
+        previous = suffixes[rank[index] - 1]
+        while index + common < length and previous + common < length \
+                and sequence[index + common] == sequence[previous + common]:
+            common += 1
+
+        lcp[rank[index]] = common
+        common = max(common - 1, 0)
+
+    return lcp
+
+
+def savings(length, count):
+    # every copy shrinks to one CALL, and the subroutine costs its body plus a RET.
+    return 2 * (count * length - count - length - 1)
+
+
+def best_repeat(sequence):
+    """
+    Finds the repeated sequence that saves the most bytes when it's extracted.
+    :param sequence: the instruction stream, with unique separators between the straight line regions.
+    :type sequence: list
+    :return: saved bytes, length and the start positions of the copies to replace, None when nothing is worth it.
+    :rtype: tuple
+    """
+
+    suffixes = suffix_array(sequence)
+    lcp = lcp_array(sequence, suffixes)
+
+    best = None
+
+    def consider(length, start, end):
+        nonlocal best
+
+        # copies of a repeat may overlap, so we only keep the ones that don't.
+        positions = []
+        for position in sorted(suffixes[start:end + 1]):
+            if not positions or position >= positions[-1] + length:
+                positions.append(position)
+
+        saved = savings(length, len(positions))
+        if saved > 0 and (best is None or saved > best[0]):
+            best = (saved, length, positions)
+
+    # walk the lcp intervals with a stack, every interval is a group of suffixes sharing a prefix of its length.
+    stack = [(0, 0)]  # (lcp value, left bound)
+    for index in range(1, len(suffixes) + 1):
+        current = lcp[index] if index < len(suffixes) else 0
+        left = index - 1
+
+        while current < stack[-1][0]:
+            length, left = stack.pop()
+            if length >= 2:
+                consider(length, left, index - 1)
+
+        if current > stack[-1][0]:
+            stack.append((current, left))
+
+    return best
+
+
+def straight_line_regions(buffer, end):
+    """
+    Splits the buffer into runs of instructions that can be moved into a subroutine.
+    :param buffer:
+    :param end: only entries before this index are looked at.
+    :return: lists of buffer indices.
+    :rtype: list
+    """
+
+    regions = []
+    region = []
+    after_skip = False
+
+    for index, entry in enumerate(buffer[:end]):
+        movable = isinstance(entry, Instruction) and not entry.is_control_flow() and not after_skip
+
+        if movable:
+            region.append(index)
+        elif region:
+            regions.append(region)
+            region = []
+
+        # the instruction after a skip must stay where it is, otherwise the skip would jump over the whole CALL.
+        after_skip = isinstance(entry, Instruction) and entry.is_skip()
+
+    if region:
+        regions.append(region)
+
+    return regions
+
+
+def runs_past_end(buffer):
+    """
+    Tells whether the program can carry on past its last instruction, into whatever is appended after it.
+    :param buffer: list of Label, Instruction and Data entries.
+    :rtype: bool
+    """
+
+    instructions = [entry for entry in buffer if isinstance(entry, Instruction)]
+    if not instructions:
+        return False
+
+    last = instructions[-1]
+    if not (last.is_jump() or last.is_return()):
+        return True
+
+    # a skip right before the last JP or RET can jump over it.
+    return len(instructions) > 1 and instructions[-2].is_skip()
+
+
+def call_depth(buffer):
+    """
+    Works out how many return addresses the program can have on the stack at once.
+    :return: the depth, or None when it can't be bounded (recursion, or a call we can't follow).
+    :rtype: int
+    """
+
+    labels = {entry.name: index for index, entry in enumerate(buffer) if isinstance(entry, Label)}
+
+    def callees(start):
+        # follows the code from start until it returns, collecting every subroutine it calls.
+        found = set()
+        pending = [start]
+        visited = set()
+
+        while pending:
+            index = pending.pop()
+            if index in visited or index >= len(buffer):
+                continue
+            visited.add(index)
+
+            entry = buffer[index]
+            if isinstance(entry, Data):
+                continue
+            if isinstance(entry, Label):
+                pending.append(index + 1)
+                continue
+
+            target = entry.label_reference()
+            if entry.is_call():
+                if target not in labels:
+                    return None
+                found.add(target)
+                pending.append(index + 1)
+            elif entry.is_computed_jump():
+                return None
+            elif entry.is_jump():
+                if target not in labels:
+                    return None
+                pending.append(labels[target])
+            elif entry.is_skip():
+                pending += [index + 1, index + 2]
+            elif not entry.is_return():
+                pending.append(index + 1)
+
+        return found
+
+    depths = {}
+
+    def depth(name, path):
+        if name in path:
+            return None  # recursion, the depth depends on the data.
+        if name not in depths:
+            called = callees(labels[name])
+            if called is None:
+                return None
+
+            deepest = 0
+            for callee in called:
+                callee_depth = depth(callee, path | {name})
+                if callee_depth is None:
+                    return None
+                deepest = max(deepest, callee_depth)
+
+            depths[name] = deepest + 1
+
+        return depths[name]
+
+    deepest = 0
+    for entry in buffer:
+        if isinstance(entry, Instruction) and entry.is_call():
+            name = entry.label_reference()
+            if name not in labels:
+                return None
+
+            called_depth = depth(name, frozenset())
+            if called_depth is None:
+                return None
+            deepest = max(deepest, called_depth)
+
+    return deepest
+
+
+def outline(buffer, key):
+    """
+    Replaces repeated instruction sequences with calls to shared subroutines, appended at the end of the program.
+    When the program can run past its end, the subroutines are put behind a jump to itself, so it stops there instead
+    of running into them.
+    :param buffer: list of Label, Instruction and Data entries.
+    :type buffer: list
+    :param key: function giving the value an instruction is compared by, usually its encoded opcode.
+    :return: the new buffer, the number of bytes saved and the number of subroutines created.
+    :rtype: tuple
+    """
+
+    depth = call_depth(buffer)
+    if depth is None or depth + 1 > MAX_STACK_DEPTH:
+        # there's no room on the stack for one more call.
+        return buffer, 0, 0
+
+    # the guard is a JP to itself, it costs 2 bytes once.
+    guard = runs_past_end(buffer)
+
+    buffer = list(buffer)
+    original_end = len(buffer)  # the subroutines we append are never outlined again.
+    total_saved = 0
+    subroutines = 0
+
+    while True:
+        regions = straight_line_regions(buffer, original_end)
+
+        sequence = []
+        positions = []  # the buffer index of every symbol in the sequence.
+        keys = {}
+        separator = -1
+
+        for region in regions:
+            for index in region:
+                sequence.append(keys.setdefault(key(buffer[index]), len(keys)))
+                positions.append(index)
+
+            # unique separators make sure no repeat spans two regions.
+            sequence.append(separator)
+            positions.append(None)
+            separator -= 1
+
+        repeat = best_repeat(sequence)
+        if repeat is None:
+            break
+
+        saved, length, starts = repeat
+        name = f'__outlined_{subroutines}'
+
+        if guard:
+            if saved <= 2:
+                # the guard would take what the subroutine saves.
+                break
+
+            buffer += [Label('__outlined_guard'), Instruction(['JP', '$__outlined_guard'])]
+            saved -= 2
+            guard = False
+
+        body = [Instruction(buffer[positions[index]].words) for index in range(starts[0], starts[0] + length)]
+
+        # replace the copies back to front so the indices of the earlier copies stay valid. The removed
+        # entries are swapped for Nones first, so original_end doesn't move either.
+        for start in reversed(starts):
+            first = positions[start]
+            buffer[first] = Instruction(['CALL', f'${name}'])
+            for index in range(start + 1, start + length):
+                buffer[positions[index]] = None
+
+        buffer += [Label(name)] + body + [Instruction(['RET'])]
+
+        original_end -= sum(1 for entry in buffer[:original_end] if entry is None)
+        buffer = [entry for entry in buffer if entry is not None]
+
+        total_saved += saved
+        subroutines += 1
+
+    return buffer, total_saved, subroutines
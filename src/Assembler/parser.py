@@ -14,7 +14,8 @@ class Node:
         print(f"{depth}  " * depth, end="| ")
         print(f"{self.value}")
         for child in self.children:
-            child.print_tree(depth + 1)
+            if child is not None:  # FOR and IF leave out the parts they don't have.
+                child.print_tree(depth + 1)
 
 
 class ArithmeticNode(Node):
@@ -32,6 +33,55 @@ class RelationalNode(Node):
         super().__init__(value="=")
 
 
+class LogicalNode(Node):
+    # children: left, right. && and || only evaluate the right side when the left side doesn't decide the result.
+    def __init__(self, operator, left, right):
+        super().__init__(value=operator)
+        self.children = [left, right]
+
+
+class BlockNode(Node):
+    # The statements between { and }.
+    def __init__(self, statements):
+        super().__init__(value="{}")
+        self.children = statements
+
+
+class IfNode(Node):
+    # children: condition, body, else body (None without an ELSE)
+    def __init__(self, condition, body, else_body=None):
+        super().__init__(value="IF")
+        self.children = [condition, body, else_body]
+
+
+class SwitchNode(Node):
+    # children: subject, default body (None without a DEFAULT), then the CaseNodes
+    def __init__(self, subject, cases, default=None):
+        super().__init__(value="SWITCH")
+        self.children = [subject, default] + cases
+
+
+class CaseNode(Node):
+    # children: value, body
+    def __init__(self, value, body):
+        super().__init__(value="CASE")
+        self.children = [value, body]
+
+
+class WhileNode(Node):
+    # children: condition, body
+    def __init__(self, condition, body):
+        super().__init__(value="WHILE")
+        self.children = [condition, body]
+
+
+class ForNode(Node):
+    # children: initialization, condition, step, body
+    def __init__(self, initialization, condition, step, body):
+        super().__init__(value="FOR")
+        self.children = [initialization, condition, step, body]
+
+
 class Scope:
     def __init__(self):
         self.variables = {}
@@ -43,6 +93,12 @@ class Scope:
         return self.variables.get(name)
 
 
+# the bitwise operators, loosest binding first.
+BITWISE_PRECEDENCE = [("|",), ("^",), ("&",), ("<<", ">>")]
+
+RELATIONAL_OPERATORS = ('>', '<', '<=', '>=', "==", "!=")
+
+
 class Parser:
 
     def __init__(self, token_list):
@@ -52,6 +108,8 @@ class Parser:
         self.head = self.tree
         self.context_stack = []
         self.scopes = [Scope()]  # Initialize with global scope
+        self.source_map = getattr(token_list, "source_map", None)  # used to point errors at the source.
+        self.nodes = {}  # expression nodes by (class, operator, child ids), see intern.
 
     def push_context(self, context):
         self.context_stack.append(context)
@@ -74,12 +132,39 @@ class Parser:
     def exit_scope(self):
         return self.scopes.pop()
 
+    def syntax_error(self, token, message='Invalid syntax'):
+        """
+        Builds a SyntaxError pointing at the token, the line and column are only worked out here.
+        :param token: the offending token, None when we ran out of tokens.
+        :param message:
+        :rtype: SyntaxError
+        """
+
+        if token is None or token.offset is None or self.source_map is None:
+            return SyntaxError(message)
+
+        line, column = self.source_map.location(token.offset)
+        return SyntaxError(message, (self.source_map.file_name, line, column, self.source_map.line_text(line)))
+
+    def intern(self, node):
+        """
+        Hash-conses an expression node: equal expressions share a single node, so V2 + V3 is the same object
+        wherever it's written. Children are interned before their parent, so their ids identify them.
+        :param node: a node whose children are all interned.
+        :type node: Node
+        :return: the node already in the table, or this one.
+        :rtype: Node
+        """
+
+        key = (type(node), node.value, tuple(id(child) for child in node.children))
+        return self.nodes.setdefault(key, node)
+
     def eat(self, token_type):
 
-        if self.current_token.type == token_type:
+        if self.current_token is not None and self.current_token.type == token_type:
             self.current_token = self.token_list.dequeue()
         else:
-            raise SyntaxError('Invalid syntax')
+            raise self.syntax_error(self.current_token, f'Invalid syntax, expected {token_type}')
 
     def parse_lines(self):
         """
@@ -88,30 +173,47 @@ class Parser:
         """
 
         while self.current_token:
+            if self.current_token.type == "EOF":
+                self.eat("EOF")
+                break
+
+            if self.current_token.type == "RBRACE":
+                raise self.syntax_error(self.current_token, 'Unexpected RBRACE')
+
             node = self.parse_expression()  # results are stores in the internal parser tree, self.tree
 
-            self.tree.append(node)
+            if node is not None:
+                self.tree.append(node)
 
-            if self.current_token.type == "EOF":
-                self.eat("EOF")
+            self.end_statement(node)
 
         return self.tree
 
+    def end_statement(self, node):
+        # Statements end with a ;, statements with a block (IF, loops) end with the block's closing brace.
+        if self.current_token is None or self.current_token.type in ("EOF", "RBRACE"):
+            return
+
+        if self.current_token.type == "EOL":
+            self.eat("EOL")
+        elif not isinstance(node, (IfNode, SwitchNode, WhileNode, ForNode)):
+            raise self.syntax_error(self.current_token)
+
     def parse_term(self):
         node_left = self.parse_factor()
 
-        while self.current_token.type == "arithmetic_operator" and self.current_token.value in ("*", "/"):
+        while self.current_token.type == "arithmetic_operator" and self.current_token.value in ("*", "/", "%"):
             operator_token = self.current_token
             self.eat(operator_token.type)
             node_right = self.parse_factor()
 
             # Create term node with operator and left/right nodes
-            term_node = Node(value=operator_token.value)
+            term_node = ArithmeticNode(operator=operator_token.value)
             term_node.children.append(node_left)
             term_node.children.append(node_right)
 
             # Update left node for next iteration
-            node_left = term_node
+            node_left = self.intern(term_node)
 
         return node_left
 
@@ -120,20 +222,20 @@ class Parser:
         if token.type == 'register':
             self.eat("register")
             # Create and return a node for the register value
-            return Node(value=token.value)  # Assuming token.value holds the register value
+            return self.intern(Node(value=token.value))  # Assuming token.value holds the register value
         elif token.type == "number":
             self.eat("number")
-            return Node(value=token.value)
+            return self.intern(Node(value=token.value))
         elif token.type == "EOF":
             self.eat("EOF")
             return Node(value=token.value)
         elif token.type == "LPAREN":
             self.eat("LPAREN")
-            node = self.parse_expression()
+            node = self.parse_logical_operator(self.parse_expression())
             self.eat("RPAREN")
             return node
         else:
-            raise SyntaxError('Invalid syntax')
+            raise self.syntax_error(token)
 
     def parse_expression(self):
         token = self.current_token
@@ -149,6 +251,18 @@ class Parser:
         if token is None:
             return None
 
+        if token.type == "keyword":
+            if token.value == "IF":
+                return self.parse_if_expressions()
+            elif token.value == "SWITCH":
+                return self.parse_switch_expressions()
+            elif token.value == "WHILE":
+                return self.parse_while_expressions()
+            elif token.value == "FOR":
+                return self.parse_for_expressions()
+            else:
+                raise self.syntax_error(token, f'Unexpected {token.value}')
+
         if token.type in ['number', 'register']:
             next_token = self.token_list.peek()
 
@@ -159,15 +273,16 @@ class Parser:
             elif next_token.type == "assignment_operator":
                 expression = self.parse_assignment_expressions()
 
-            elif next_token.type == "arithmetic_operator" and next_token.value in (
-                    "+", "-"):  # + or - because * / are terms
+            elif next_token.type in ("arithmetic_operator", "bitwise_operator"):
+                # arithmetic expressions parse their terms (* / %) first, then the + and - between them, then the
+                # shifts and the bitwise operators.
                 expression = self.parse_arithmetic_expressions()
             else:
                 # For when no operation is used.
                 expression = self.parse_term()
 
         if token.type == "LPAREN":
-            expression = self.parse_term()
+            expression = self.parse_arithmetic_expressions()
 
 
         if self.current_token.type != "EOL":
@@ -184,7 +299,27 @@ class Parser:
 
         return expression
 
-    def parse_arithmetic_expressions(self):
+    def parse_arithmetic_expressions(self, level=0):
+        # the bitwise operators bind like they do in Python: | is the loosest, then ^, &, the shifts, and + and -.
+        if level == len(BITWISE_PRECEDENCE):
+            return self.parse_additive_expressions()
+
+        node_left = self.parse_arithmetic_expressions(level + 1)
+
+        while self.current_token.type == "bitwise_operator" and self.current_token.value in BITWISE_PRECEDENCE[level]:
+            operator_token = self.current_token.value
+            self.eat("bitwise_operator")
+            node_right = self.parse_arithmetic_expressions(level + 1)
+
+            operator_node = ArithmeticNode(operator=operator_token)
+            operator_node.children.append(node_left)
+            operator_node.children.append(node_right)
+
+            node_left = self.intern(operator_node)
+
+        return node_left
+
+    def parse_additive_expressions(self):
         node_left = self.parse_term()
 
         while self.current_token.type == "arithmetic_operator":
@@ -199,14 +334,105 @@ class Parser:
 
             # For cases when there are multple arthmetic operation in one line
             # we need to set left to the previous operator.
-            node_left = operator_node
+            node_left = self.intern(operator_node)
 
         return node_left
 
+    def parse_condition(self):
+        # a comparison, or comparisons joined by && and ||.
+        return self.parse_logical_operator(self.parse_expression())
+
+    def parse_logical_operator(self, left_expression):
+        # && binds tighter than ||, so V1 == 1 || V2 == 2 && V3 == 3 is V1 == 1 || (V2 == 2 && V3 == 3).
+        left_expression = self.parse_and_operator(left_expression)
+
+        while self.current_token.type == "logical_operator" and self.current_token.value == "||":
+            self.eat("logical_operator")
+            right_expression = self.parse_and_operator(self.parse_expression())
+            left_expression = self.intern(LogicalNode("||", left_expression, right_expression))
+
+        return left_expression
+
+    def parse_and_operator(self, left_expression):
+        while self.current_token.type == "logical_operator" and self.current_token.value == "&&":
+            self.eat("logical_operator")
+            left_expression = self.intern(LogicalNode("&&", left_expression, self.parse_expression()))
+
+        return left_expression
+
     def parse_if_expressions(self):
+        # IF (condition) { statements } ELSE { statements }, ELSE IF chains nest in the ELSE.
         self.eat("keyword")
-        condition = self.parse_expression()
-        pass
+        self.eat("LPAREN")
+        condition = self.parse_condition()
+        self.eat("RPAREN")
+
+        body = BlockNode(self.parse_scope_block_expression())
+        else_body = None
+
+        if self.current_token.type == "keyword" and self.current_token.value == "ELSE":
+            self.eat("keyword")
+
+            if self.current_token.type == "keyword" and self.current_token.value == "IF":
+                else_body = BlockNode([self.parse_if_expressions()])
+            else:
+                else_body = BlockNode(self.parse_scope_block_expression())
+
+        return IfNode(condition, body, else_body)
+
+    def parse_switch_expressions(self):
+        # SWITCH (expression) { CASE constant { statements } ... DEFAULT { statements } }, cases don't fall through.
+        self.eat("keyword")
+        self.eat("LPAREN")
+        subject = self.parse_expression()
+        self.eat("RPAREN")
+        self.eat("LBRACE")
+
+        cases = []
+        default = None
+
+        while self.current_token.type != "RBRACE":
+            token = self.current_token
+
+            if token.type == "keyword" and token.value == "CASE":
+                self.eat("keyword")
+                value = self.parse_factor()
+                cases.append(CaseNode(value, BlockNode(self.parse_scope_block_expression())))
+            elif token.type == "keyword" and token.value == "DEFAULT" and default is None:
+                self.eat("keyword")
+                default = BlockNode(self.parse_scope_block_expression())
+            else:
+                raise self.syntax_error(token, 'Invalid syntax, expected CASE or DEFAULT')
+
+        self.eat("RBRACE")
+
+        return SwitchNode(subject, cases, default)
+
+    def parse_while_expressions(self):
+        # WHILE (condition) { statements }
+        self.eat("keyword")
+        self.eat("LPAREN")
+        condition = self.parse_condition()
+        self.eat("RPAREN")
+
+        body = BlockNode(self.parse_scope_block_expression())
+
+        return WhileNode(condition, body)
+
+    def parse_for_expressions(self):
+        # FOR (initialization; condition; step) { statements }
+        self.eat("keyword")
+        self.eat("LPAREN")
+        initialization = self.parse_expression()
+        self.eat("EOL")
+        condition = self.parse_condition()
+        self.eat("EOL")
+        step = self.parse_expression()
+        self.eat("RPAREN")
+
+        body = BlockNode(self.parse_scope_block_expression())
+
+        return ForNode(initialization, condition, step, body)
 
     def parse_scope_block_expression(self):
         self.eat('LBRACE')
@@ -214,11 +440,18 @@ class Parser:
 
         # Parse expressions within the scope block
         expressions = []
-        while self.current_token.type != '}':  # looping through all expressions until we meet close scope.
+        while self.current_token.type != 'RBRACE':  # looping through all expressions until we meet close scope.
+            if self.current_token.type == "EOF":
+                raise self.syntax_error(self.current_token, 'Invalid syntax, expected RBRACE')
+
             expression = self.parse_expression()
-            expressions.append(expression)
 
-        self.eat('}')  # Consume the '}' token
+            if expression is not None:
+                expressions.append(expression)
+
+            self.end_statement(expression)
+
+        self.eat('RBRACE')  # Consume the '}' token
         exited_scope = self.exit_scope()  # Exit the current scope
 
         # Handle variable declarations within the scope block
@@ -232,8 +465,9 @@ class Parser:
         # In the relational function, we will parse the second expression, so we can then compare the two
         # and return it as the final expression.
 
-        while self.current_token.value in ['>', '<', '<=', '>=', "==", "!="]:
-            operator_node = Node(value=self.current_token.value)
+        while self.current_token.value in RELATIONAL_OPERATORS:
+            operator_token = self.current_token
+            operator_node = Node(value=operator_token.value)
             self.eat(self.current_token.type)
 
             # Assignments can either be 1 term or multiple, so we must check.
@@ -242,10 +476,15 @@ class Parser:
             else:
                 right_expression = self.parse_expression()  # We use expression because we can't assume number of terms.
 
+            # a comparison gives no value to compare, V1 == 1 == 2 is an error and not V1 == (1 == 2).
+            if left_expression.value in RELATIONAL_OPERATORS or right_expression.value in RELATIONAL_OPERATORS:
+                raise self.syntax_error(operator_token, f'Invalid syntax, {operator_token.value} can\'t compare the '
+                                                        f'result of a comparison')
+
             operator_node.append(left_expression)
             operator_node.append(right_expression)
 
-            left_expression = operator_node
+            left_expression = self.intern(operator_node)
 
         return left_expression  # Return the operator node
 
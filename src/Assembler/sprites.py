@@ -0,0 +1,185 @@
+import hashlib
+import os
+import re
+
+import numpy as np
+
+# CHIP-8 sprites are 8 pixels wide and at most 15 rows tall (DRW Vx, Vy, n with n <= 0xF).
+TILE_WIDTH = 8
+TILE_HEIGHT = 15
+
+# Converted tilesets, keyed by the hash of the image file and the threshold used. They are kept in memory for the
+# run, and in files in the cache directory for later runs.
+_tile_cache = {}
+CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "chip8-assembler", "sprites")
+
+# part of the name of every cache file. Bump it when the conversion or the file layout changes, the files of older
+# versions are then never read again.
+CACHE_VERSION = 1
+
+
+def _read_header(data, count):
+    """
+    Reads the magic number and the `count` following numbers of a netpbm header, skipping comments.
+    :return: the header values and the offset of the first byte of the raster.
+    :rtype: tuple
+    """
+
+    values = []
+    offset = 0
+
+    while len(values) < count + 1:
+        match = re.compile(rb"\s*(?:#[^\n]*\n\s*)*(\S+)").match(data, offset)
+
+        if match is None:
+            raise ValueError("Image header is incomplete.")
+
+        values.append(match.group(1))
+        offset = match.end()
+
+    # a single whitespace character separates the header from the raster.
+    return values, offset + 1
+
+
+def load_pixels(data, threshold=None):
+    """
+    Decodes a plain or raw PBM/PGM image into a 2d boolean array where True is a lit pixel.
+
+    For PBM images the black (1) pixels are lit, for PGM images every pixel darker than the threshold is lit so both
+    formats follow the "ink is on" convention. The default threshold is half the maximum gray value.
+    :param data: the contents of the image file.
+    :type data: bytes
+    :param threshold: gray value below which a PGM pixel is lit.
+    :type threshold: int
+    :rtype: numpy.ndarray
+    """
+
+    magic = data[:2]
+
+    if magic in (b"P1", b"P4"):
+        (_, width, height), offset = _read_header(data, 2)
+        width, height = int(width), int(height)
+
+        if magic == b"P1":
+            # plain PBM, the pixels may or may not be separated by whitespace.
+            raster = np.frombuffer(re.sub(rb"#[^\n]*|\s", b"", data[offset - 1:]), dtype=np.uint8)
+            pixels = (raster[:width * height] - ord("0")).reshape(height, width)
+        else:
+            # raw PBM rows are already packed, we unpack them so every format goes through the same slicing.
+            row_bytes = (width + 7) // 8
+            raster = np.frombuffer(data, dtype=np.uint8, count=row_bytes * height, offset=offset)
+            pixels = np.unpackbits(raster.reshape(height, row_bytes), axis=1)[:, :width]
+
+        return pixels.astype(bool)
+
+    if magic in (b"P2", b"P5"):
+        (_, width, height, max_value), offset = _read_header(data, 3)
+        width, height, max_value = int(width), int(height), int(max_value)
+
+        if magic == b"P2":
+            raster = np.array(data[offset - 1:].split(), dtype=np.uint16)[:width * height]
+        else:
+            dtype = np.uint8 if max_value < 256 else np.dtype(">u2")
+            raster = np.frombuffer(data, dtype=dtype, count=width * height, offset=offset)
+
+        if threshold is None:
+            threshold = (max_value + 1) // 2
+
+        return raster.reshape(height, width) < threshold
+
+    raise ValueError("Only PBM (P1/P4) and PGM (P2/P5) images are supported.")
+
+
+def slice_tiles(pixels):
+    """
+    Packs an image into DRW ready sprites, 8 pixels wide and up to 15 rows tall, in row major tile order.
+    :param pixels: 2d boolean array of lit pixels.
+    :type pixels: numpy.ndarray
+    :return: the sprite data of every tile.
+    :rtype: list
+    """
+
+    height, width = pixels.shape
+
+    # packbits pads the last byte of every row with zeros, so each column of the result is one 8 pixel wide strip.
+    packed = np.packbits(pixels, axis=1)
+
+    tiles = []
+    for row in range(0, height, TILE_HEIGHT):
+        band = packed[row:row + TILE_HEIGHT]
+
+        # transposing gives each strip of the band as one contiguous row of bytes.
+        for strip in np.ascontiguousarray(band.T):
+            tiles.append(strip.tobytes())
+
+    return tiles
+
+
+def load_tiles(file_name, threshold=None):
+    """
+    Loads an image file and converts it to sprites. Results are cached on the hash of the file contents and the
+    threshold, across runs.
+    :param file_name: path to a PBM or PGM image.
+    :type file_name: str
+    :param threshold: gray value below which a PGM pixel is lit.
+    :type threshold: int
+    :rtype: list
+    """
+
+    with open(file_name, "rb") as file:
+        data = file.read()
+
+    key = (hashlib.sha1(data).hexdigest(), threshold)
+
+    if key not in _tile_cache:
+        _tile_cache[key] = read_cached_tiles(key)
+
+    if _tile_cache[key] is None:
+        _tile_cache[key] = slice_tiles(load_pixels(data, threshold))
+        write_cached_tiles(key, _tile_cache[key])
+
+    return _tile_cache[key]
+
+
+def cache_file(key):
+    digest, threshold = key
+    return os.path.join(CACHE_DIRECTORY,
+                        f"v{CACHE_VERSION}-{digest}-{'default' if threshold is None else threshold}.bin")
+
+
+def read_cached_tiles(key):
+    # the cache file holds every tile preceded by its length, None when the image hasn't been converted before.
+    try:
+        with open(cache_file(key), "rb") as file:
+            data = file.read()
+    except OSError:
+        return None
+
+    tiles = []
+    offset = 0
+    while offset < len(data):
+        length = data[offset]
+        tiles.append(data[offset + 1:offset + 1 + length])
+        offset += 1 + length
+
+    if offset != len(data):
+        # cut short, it's converted again.
+        return None
+
+    return tiles
+
+
+def write_cached_tiles(key, tiles):
+    contents = b"".join(bytes([len(tile)]) + tile for tile in tiles)
+
+    try:
+        os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+
+        # written under another name and renamed, so a run stopped halfway never leaves a partial file behind.
+        temporary = cache_file(key) + f".{os.getpid()}"
+        with open(temporary, "wb") as file:
+            file.write(contents)
+        os.replace(temporary, cache_file(key))
+    except OSError:
+        # the cache only saves time, the tiles are still right without it.
+        pass
@@ -0,0 +1,449 @@
+"""
+Superoptimization of short register expressions.
+
+The superoptimizer looks for the shortest sequence that computes an expression. It tries every sequence up to a few
+instructions long, made of the ALU instructions (8XYn), ADD Vx, kk (7XKK) and LD Vx, kk (6XKK). The generator uses
+the sequence it finds whenever that's shorter than its usual code. V3 = V1 >> 7 is 7 SHR the usual way, but only
+3 instructions here: copy V1, SHL it so its top bit lands in VF, and copy VF.
+
+The search works on the shape of the expression: its registers named a and b in order of appearance, and its
+constants as they are. A sequence is written with these names. t is the register assigned to, s is a scratch register,
+and VF is the flag. The inputs are only ever read, so they hold the same values afterwards. When t is also an
+input, the input is t.
+
+The empty sequence is tried first, V1 = (V1 ^ V2) ^ V2 needs no code at all. Then all the sequences of one length run
+at once, with NumPy, over a sample of inputs. When several sequences leave the same register contents, only one of
+them is extended. A sequence leaving the value of the expression in t on the sample is then run on every
+possible input, all 65536 pairs for two registers. It's only used when it gets every one of them right, so whatever
+the search finds is correct.
+
+Sequences are only merged when they leave the same registers on every input, so none is dropped that could lead to a
+shorter sequence. With one input the sample is all 256 values. With two inputs it's 32 of the 65536 pairs, and the
+sequences that look alike on the sample are run on all the pairs before one of them is dropped. That's slow, so a
+length with more than MAX_CHECKS of those merges them on the sample alone, and a length with more than MAX_STATES
+register contents isn't extended at all. In both cases a sequence found at most one instruction longer than that
+length is still the shortest, a longer one is only the shortest the search found. The memo table records which.
+
+VF is modelled like any other register. ADD, SUB, SUBN, SHR and SHL set it. The COSMAC VIP cleared it after OR, AND and
+XOR, but later interpreters leave it alone, so after those VF counts as unknown until something sets it again. SHR and
+SHL only shift a register into itself, which does the same on every interpreter. A register that's unknown, like s
+before it's written, is never read.
+
+A search takes up to a few seconds. Its result is kept in a memo table on disk and used by every later build. The
+table also records shapes with nothing shorter than the usual code.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from .codegen import INPUT_NAMES
+
+# Sequences up to this many instructions long are searched.
+MAX_LENGTH = 5
+
+# A length with more distinct register contents than this stops being extended, the longer sequences are not searched.
+MAX_STATES = 100000
+
+# With two inputs, a length with more new states looking like another one on the sample than this merges them on the
+# sample alone, running that many on every input would take too long.
+MAX_CHECKS = 2000
+
+# Number of input pairs every sequence of two inputs runs on before being checked on all of them. A single input runs
+# on all its 256 values.
+SAMPLE_SIZE = 32
+
+MEMO_FILE = os.path.join(os.path.expanduser("~"), ".cache", "chip8-assembler", "superoptimizer.json")
+MEMO_VERSION = 3
+
+# rows of the register contents: the target, the scratch register and VF, then the inputs, which are never written.
+T, S, F = 0, 1, 2
+WRITABLE = ("t", "s")
+
+ALU = ("LD", "OR", "AND", "XOR", "ADD", "SUB", "SUBN")
+
+# values that are often handy as immediates, on top of the constants of the expression and their negatives.
+IMMEDIATES = (0x00, 0x01, 0xFF)
+
+
+def instruction_set(input_names, constants):
+    """
+    Lists every instruction a sequence can be made of.
+    :param input_names: the names of the inputs that aren't the target, in the order of their rows.
+    :type input_names: list
+    :param constants: the constants of the expression.
+    :type constants: set
+    :return: (mnemonic, destination row, source row or None, immediate or None) tuples.
+    :rtype: list
+    """
+
+    sources = [T, S, F] + [F + 1 + count for count in range(len(input_names))]
+    immediates = sorted(set(IMMEDIATES) | {value % 256 for value in constants} | {-value % 256 for value in constants})
+
+    instructions = []
+    for destination in (T, S):
+        for mnemonic in ALU:
+            for source in sources:
+                if mnemonic == "LD" and source == destination:
+                    continue
+                instructions.append((mnemonic, destination, source, None))
+
+        for mnemonic in ("SHR", "SHL"):
+            instructions.append((mnemonic, destination, destination, None))
+
+        for value in immediates:
+            instructions.append(("LD", destination, None, value))
+            if value:
+                instructions.append(("ADD", destination, None, value))
+
+    return instructions
+
+
+def step(instruction, values, valid, inputs):
+    """
+    Runs an instruction in a batch of states.
+    :param values: the writable registers of every state, uint8 array of shape (states, 3, samples).
+    :param valid: which of them hold a known value, bool array of shape (states, 3).
+    :param inputs: the inputs that aren't the target, uint8 array of shape (inputs, samples).
+    :return: the new values and valid, and the states the instruction can run in.
+    :rtype: tuple
+    """
+
+    mnemonic, destination, source, immediate = instruction
+
+    values = values.copy()
+    valid = valid.copy()
+    runnable = np.ones(len(values), dtype=bool)
+
+    x = values[:, destination].astype(np.int16)
+    if source is None:
+        y = immediate
+    elif source <= F:
+        y = values[:, source].astype(np.int16)
+        runnable &= valid[:, source]
+    else:
+        y = inputs[source - F - 1].astype(np.int16)
+
+    if mnemonic != "LD":
+        runnable &= valid[:, destination]
+
+    flag = None
+    if mnemonic == "LD":
+        result = y
+    elif mnemonic == "OR":
+        result = x | y
+    elif mnemonic == "AND":
+        result = x & y
+    elif mnemonic == "XOR":
+        result = x ^ y
+    elif mnemonic == "ADD":
+        result = x + y
+        if source is not None:  # ADD Vx, kk leaves VF alone.
+            flag = result > 0xFF
+    elif mnemonic == "SUB":
+        result = x - y
+        flag = x >= y
+    elif mnemonic == "SUBN":
+        result = y - x
+        flag = y >= x
+    elif mnemonic == "SHR":
+        result = x >> 1
+        flag = x & 1
+    else:
+        result = x << 1
+        flag = x >> 7
+
+    values[:, destination] = np.asarray(result) & 0xFF
+    valid[:, destination] = True
+
+    if flag is not None:
+        values[:, F] = flag
+        valid[:, F] = True
+    elif mnemonic in ("OR", "AND", "XOR"):
+        values[:, F] = 0
+        valid[:, F] = False
+
+    return values, valid, runnable
+
+
+def sample_inputs(count, size=SAMPLE_SIZE):
+    # the values where carries and borrows happen, then random ones. Seeded, so a search always finds the same.
+    edges = [0x00, 0x01, 0x02, 0x7F, 0x80, 0x81, 0xFE, 0xFF]
+    generator = np.random.default_rng(0xC8)
+
+    rows = [generator.permutation(edges * (size // len(edges) + 1))[:size // 2] for _ in range(count)]
+    return np.concatenate([np.array(rows, dtype=np.uint8).reshape(count, -1),
+                           generator.integers(0, 256, (count, size - size // 2), dtype=np.uint8)], axis=1)
+
+
+def all_inputs(count):
+    # every combination of values of the inputs.
+    grid = np.meshgrid(*[np.arange(256, dtype=np.uint8)] * count, indexing="ij")
+    return np.array([axis.ravel() for axis in grid], dtype=np.uint8)
+
+
+class Superoptimizer:
+
+    def __init__(self, memo_file=None, max_length=MAX_LENGTH):
+        self.memo_file = MEMO_FILE if memo_file is None else memo_file
+        self.max_length = max_length
+        self.memo = self.load()
+        self.changed = False
+
+    def load(self):
+        try:
+            with open(self.memo_file, "r") as file:
+                contents = json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+        if not isinstance(contents, dict) or contents.get("version") != MEMO_VERSION:
+            # written by another version, the searches are done again.
+            return {}
+
+        return contents.get("shapes", {})
+
+    def save(self):
+        if not self.changed:
+            return
+
+        directory = os.path.dirname(self.memo_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # written under another name and renamed, so a build reading the table while another one writes it never
+        # sees it cut short.
+        temporary = f"{self.memo_file}.{os.getpid()}"
+        with open(temporary, "w") as file:
+            json.dump({"version": MEMO_VERSION, "shapes": self.memo}, file, indent=1, sort_keys=True)
+        os.replace(temporary, self.memo_file)
+
+        self.changed = False
+
+    def lookup(self, shape, function, input_count, target_input, constants, length):
+        """
+        Finds the shortest sequence computing an expression, if it's shorter than the code it would replace.
+        :param shape: the normalized expression, the key of the memo table.
+        :type shape: str
+        :param function: computes the expression from the values of its inputs, given as arrays of ints.
+        :param input_count: the number of registers the expression reads, 1 or 2.
+        :type input_count: int
+        :param target_input: the index of the input that is also the target, or None.
+        :param constants: the constants of the expression.
+        :type constants: set
+        :param length: the number of instructions of the code it would replace.
+        :type length: int
+        :return: the sequence, as (mnemonic, destination, source) names, or None.
+        :rtype: list
+        """
+
+        bound = min(length - 1, self.max_length)
+        if bound < 0:
+            return None
+
+        entry = self.memo.get(shape)
+
+        # the memo holds the sequence found up to the length it searched, or None if there isn't one, and whether
+        # that's known to be the shortest or that there's none.
+        if entry is None or (entry["sequence"] is None and entry["searched"] < bound):
+            sequence, shortest = self.search(function, input_count, target_input, constants, bound)
+            entry = {"searched": bound, "sequence": sequence, "shortest": shortest}
+            self.memo[shape] = entry
+            self.changed = True
+
+        sequence = entry["sequence"]
+        if sequence is None or len(sequence) > bound:
+            return None
+
+        return [tuple(words) for words in sequence]
+
+    def search(self, function, input_count, target_input, constants, max_length):
+        """
+        Searches the sequences in order of length for one computing the expression, starting with the empty one.
+        :return: the first sequence found, as lists of names, or None, and whether it's known to be the shortest, or
+            that there is none.
+        :rtype: tuple
+        """
+
+        input_names = [name for count, name in enumerate(INPUT_NAMES[:input_count]) if count != target_input]
+        instructions = instruction_set(input_names, constants)
+
+        # a single input is run on all its values, so states are only merged when they're the same everywhere.
+        sample = all_inputs(input_count) if input_count == 1 else sample_inputs(input_count)
+        goal = goal_of(function, sample)
+
+        def start(inputs):
+            values = np.zeros((1, 3, inputs.shape[1]), dtype=np.uint8)
+            valid = np.zeros((1, 3), dtype=bool)
+            if target_input is not None:
+                values[0, T] = inputs[target_input]
+                valid[0, T] = True
+
+            return values, valid, np.delete(inputs, target_input, axis=0) if target_input is not None else inputs
+
+        values, valid, inputs = start(sample)
+
+        # candidates are checked on every input.
+        everything = all_inputs(input_count)
+        exhaustive = start(everything), goal_of(function, everything)
+
+        if self.verify([], *exhaustive):
+            return [], True
+
+        seen = contents(values, valid)
+        levels = []  # per length, the parent state and the instruction of every state kept.
+
+        # every sequence up to this length has been tried, or is the same as one that has on every input.
+        complete = max_length
+
+        # with two inputs, the states that look alike on the sample are run on every input. The first of them with
+        # its own register contents is kept, length, index pairs of those kept, by their contents on the sample.
+        check = input_count > 1
+        kept_states = {seen[0].tobytes(): [(0, 0)]}
+        everywhere = {}  # length, index to contents on every input, of kept states already run.
+
+        for length in range(1, max_length + 1):
+            if length < max_length and len(values) > MAX_STATES:
+                complete = min(complete, length)
+            last = length == max_length or len(values) > MAX_STATES
+            kept = []
+
+            for index, instruction in enumerate(instructions):
+                new_values, new_valid, runnable = step(instruction, values, valid, inputs)
+
+                found = np.flatnonzero(runnable & new_valid[:, T] & (new_values[:, T] == goal).all(axis=1))
+                for parent in found:
+                    sequence = [instructions[count] for count in self.path(levels, length - 1, parent) + [index]]
+                    if self.verify(sequence, *exhaustive):
+                        # it's the shortest when no shorter sequence was left out.
+                        return [self.names(instruction, input_names) for instruction in sequence], \
+                            complete >= length - 1
+
+                if last:
+                    continue
+
+                states = np.flatnonzero(runnable)
+                kept.append((new_values[states], new_valid[states], states, index))
+
+            if last:
+                break
+
+            values = np.concatenate([entry[0] for entry in kept])
+            valid = np.concatenate([entry[1] for entry in kept])
+            parents = np.concatenate([entry[2] for entry in kept])
+            chosen = np.concatenate([np.full(len(entry[2]), entry[3]) for entry in kept])
+
+            # one state for every register contents, new ones only.
+            state_contents = contents(values, valid)
+            unique_contents, first, counts = np.unique(state_contents, return_index=True, return_counts=True)
+            new = ~np.isin(unique_contents, seen)
+
+            alike = np.flatnonzero(np.isin(state_contents, unique_contents[(counts > 1) | ~new]))
+            if check and len(alike) > MAX_CHECKS:
+                # too many to run on every input, from here on states are merged on the sample alone.
+                check = False
+                complete = min(complete, length)
+
+            if check:
+                first = np.sort(np.concatenate([first[new & (counts == 1)], self.tell_apart(
+                    alike, state_contents, parents, chosen, levels, kept_states, everywhere, instructions,
+                    exhaustive[0])])).astype(int)
+            else:
+                first = first[new]
+
+            values, valid = values[first], valid[first]
+            levels.append((parents[first], chosen[first]))
+            seen = np.concatenate([seen, state_contents[first]])
+
+            if check:
+                for count, state in enumerate(first):
+                    kept_states.setdefault(state_contents[state].tobytes(), []).append((length, count))
+
+            if not len(values):
+                break
+
+        return None, complete >= max_length
+
+    def tell_apart(self, alike, state_contents, parents, chosen, levels, kept_states, everywhere, instructions,
+                   state):
+        """
+        Runs the new states that look like another state on the sample on every input, and keeps those that are
+        different from all the others somewhere.
+        :param alike: indices of those new states.
+        :param kept_states: the kept states by their contents on the sample, as length, index pairs.
+        :param everywhere: the contents on every input of the kept states already run, filled in as they are.
+        :param state: the start state on every input.
+        :return: indices of the new states to keep.
+        :rtype: list
+        """
+
+        def run(sequence):
+            values, valid, inputs = state
+            for instruction in sequence:
+                values, valid, _ = step(instructions[instruction], values, valid, inputs)
+            return contents(values, valid)[0].tobytes()
+
+        groups = {}
+        for candidate in alike:
+            groups.setdefault(state_contents[candidate].tobytes(), []).append(candidate)
+
+        new_states = []
+        for key, candidates in groups.items():
+            known = set()
+            for length, index in kept_states.get(key, ()):
+                if (length, index) not in everywhere:
+                    everywhere[length, index] = run(self.path(levels, length, index))
+                known.add(everywhere[length, index])
+
+            for candidate in candidates:
+                contents_everywhere = run(self.path(levels, len(levels), parents[candidate]) + [chosen[candidate]])
+                if contents_everywhere not in known:
+                    known.add(contents_everywhere)
+                    new_states.append(candidate)
+
+        return new_states
+
+    @staticmethod
+    def path(levels, length, index):
+        # walks the parents of a kept state of the given length back to the start, gives the indices of the
+        # instructions.
+        sequence = []
+        for parents, chosen in reversed(levels[:length]):
+            sequence.append(chosen[index])
+            index = parents[index]
+
+        return sequence[::-1]
+
+    @staticmethod
+    def verify(sequence, state, goal):
+        # runs the sequence on every input.
+        values, valid, inputs = state
+
+        for instruction in sequence:
+            values, valid, runnable = step(instruction, values, valid, inputs)
+            if not runnable[0]:
+                return False
+
+        return bool(valid[0, T]) and bool((values[0, T] == goal).all())
+
+    @staticmethod
+    def names(instruction, input_names):
+        mnemonic, destination, source, immediate = instruction
+        row_names = list(WRITABLE) + ["VF"] + list(input_names)
+
+        if source is None:
+            return [mnemonic, row_names[destination], f"#{immediate:02X}"]
+
+        return [mnemonic, row_names[destination], row_names[source]]
+
+
+def contents(values, valid):
+    # the register contents of every state as one opaque value, NumPy sorts and compares them byte for byte.
+    rows = np.ascontiguousarray(np.concatenate([values.reshape(len(values), -1), valid.astype(np.uint8)], axis=1))
+    return rows.view(np.dtype((np.void, rows.shape[1]))).ravel()
+
+
+def goal_of(function, inputs):
+    # the value of the expression for every column of inputs.
+    return np.asarray(function([row.astype(np.int64) for row in inputs])) % 256
@@ -1,8 +1,57 @@
+import argparse
+
 from Assembler import Assembler, lexer
+from Assembler.linker import link_files
+
 
 def main():
+    parser = argparse.ArgumentParser(description="CHIP-8 assembler.")
+    commands = parser.add_subparsers(dest="command")
+
+    assemble = commands.add_parser("assemble", help="assemble sources into a ROM image, or into object files.")
+    assemble.add_argument("sources", nargs="*", default=["source.txt"])
+    assemble.add_argument("-c", "--compile-only", action="store_true",
+                          help="write a relocatable object file (source name with .o) for every source.")
+    assemble.add_argument("-o", "--output", help="the file to write, output.c8 by default.")
+    assemble.add_argument("--optimize-size", action="store_true")
+    assemble.add_argument("--eliminate-dead-code", action="store_true")
+    assemble.add_argument("--pack-data", action="store_true")
+    assemble.add_argument("--superoptimize", action="store_true",
+                          help="search for the shortest code of short expressions, needs NumPy.")
+
+    link = commands.add_parser("link", help="link object files into a ROM image.")
+    link.add_argument("objects", nargs="+")
+    link.add_argument("-o", "--output", default="output.c8")
+
+    arguments = parser.parse_args()
+
+    if arguments.command == "link":
+        link_files(arguments.objects, arguments.output)
+        return
+
+    if arguments.command is None:
+        # without a command we assemble source.txt, like we always did.
+        arguments = assemble.parse_args([])
+
+    if arguments.compile_only and arguments.output is not None and len(arguments.sources) > 1:
+        parser.error("-o can't be used with --compile-only and more than one source.")
+
+    if arguments.compile_only or len(arguments.sources) == 1:
+        for source in arguments.sources:
+            asm = Assembler(compile_only=arguments.compile_only)
+            asm.backend.optimize_size = arguments.optimize_size
+            asm.backend.eliminate_dead_code = arguments.eliminate_dead_code
+            asm.backend.pack_data = arguments.pack_data
+            asm.superoptimize = arguments.superoptimize
+            asm.assemble(source, arguments.output)
+        return
+
     asm = Assembler()
-    asm.assemble("source.txt")
+    asm.backend.optimize_size = arguments.optimize_size
+    asm.backend.eliminate_dead_code = arguments.eliminate_dead_code
+    asm.backend.pack_data = arguments.pack_data
+    asm.superoptimize = arguments.superoptimize
+    asm.assemble_modules(arguments.sources, arguments.output or "output.c8")
 
 
 
@@ -13,4 +62,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
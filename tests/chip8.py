@@ -0,0 +1,119 @@
+"""
+A small CHIP-8 interpreter to run the assembled ROM images in tests.
+
+The program is run until it jumps to itself, the endless loop every generated program ends in. Display, keyboard and
+timer instructions do nothing. SHR and SHL shift Vx, and OR, AND and XOR leave VF alone, like the later
+interpreters do: the code generator must not depend on either quirk.
+"""
+
+from src.Assembler.ir import MEMORY_SIZE, PROGRAM_START
+
+
+class Machine:
+
+    def __init__(self, rom, registers=None):
+        self.memory = bytearray(MEMORY_SIZE)
+        self.memory[PROGRAM_START:PROGRAM_START + len(rom)] = rom
+        self.V = [0] * 16
+        self.I = 0
+        self.pc = PROGRAM_START
+        self.stack = []
+        self.steps = 0
+
+        for register, value in (registers or {}).items():
+            self.V[register] = value
+
+    def run(self, max_steps=200000):
+        while self.steps < max_steps:
+            if not self.step():
+                return self
+
+        raise TimeoutError(f"The program didn't stop within {max_steps} instructions.")
+
+    def step(self):
+        # runs one instruction, False once the program loops on itself.
+        opcode = self.memory[self.pc] << 8 | self.memory[self.pc + 1]
+        x, y = opcode >> 8 & 0xF, opcode >> 4 & 0xF
+        kk, nnn, kind = opcode & 0xFF, opcode & 0xFFF, opcode >> 12
+        V = self.V
+
+        self.steps += 1
+        self.pc += 2
+
+        if opcode == 0x00E0:
+            pass
+        elif opcode == 0x00EE:
+            self.pc = self.stack.pop()
+        elif kind == 0x1:
+            if nnn == self.pc - 2:
+                return False
+            self.pc = nnn
+        elif kind == 0x2:
+            if len(self.stack) == 16:
+                raise OverflowError("Stack overflow.")
+            self.stack.append(self.pc)
+            self.pc = nnn
+        elif kind in (0x3, 0x4, 0x5, 0x9):
+            value = kk if kind in (0x3, 0x4) else V[y]
+            if (V[x] == value) == (kind in (0x3, 0x5)):
+                self.pc += 2
+        elif kind == 0x6:
+            V[x] = kk
+        elif kind == 0x7:
+            V[x] = (V[x] + kk) & 0xFF
+        elif kind == 0x8:
+            self.alu(opcode & 0xF, x, y)
+        elif kind == 0xA:
+            self.I = nnn
+        elif kind == 0xB:
+            self.pc = nnn + V[0]
+        elif kind in (0xC, 0xD) or (kind in (0xE, 0xF) and kk in (0x9E, 0xA1, 0x07, 0x0A, 0x15, 0x18, 0x29)):
+            pass
+        elif kind == 0xF and kk == 0x1E:
+            self.I = (self.I + V[x]) & 0xFFF
+        elif kind == 0xF and kk == 0x33:
+            self.memory[self.I:self.I + 3] = bytes([V[x] // 100, V[x] // 10 % 10, V[x] % 10])
+        elif kind == 0xF and kk == 0x55:
+            self.memory[self.I:self.I + x + 1] = bytes(V[:x + 1])
+        elif kind == 0xF and kk == 0x65:
+            V[:x + 1] = self.memory[self.I:self.I + x + 1]
+        else:
+            raise ValueError(f"Unknown instruction {opcode:04X} at {self.pc - 2:03X}.")
+
+        return True
+
+    def alu(self, operation, x, y):
+        V = self.V
+        a, b = V[x], V[y]
+
+        if operation == 0x0:
+            V[x] = b
+        elif operation == 0x1:
+            V[x] = a | b
+        elif operation == 0x2:
+            V[x] = a & b
+        elif operation == 0x3:
+            V[x] = a ^ b
+        elif operation == 0x4:
+            V[x], V[0xF] = (a + b) & 0xFF, int(a + b > 0xFF)
+        elif operation == 0x5:
+            V[x], V[0xF] = (a - b) & 0xFF, int(a >= b)
+        elif operation == 0x6:
+            V[x], V[0xF] = a >> 1, a & 1
+        elif operation == 0x7:
+            V[x], V[0xF] = (b - a) & 0xFF, int(b >= a)
+        elif operation == 0xE:
+            V[x], V[0xF] = (a << 1) & 0xFF, a >> 7
+        else:
+            raise ValueError(f"Unknown instruction 8{x:X}{y:X}{operation:X}.")
+
+
+def run(rom, registers=None):
+    """
+    Runs a ROM image until it loops on itself.
+    :param registers: register number to its value at the start.
+    :type registers: dict
+    :rtype: Machine
+    """
+
+    return Machine(rom, registers).run()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the sources import the package as src.Assembler, like assembler.py does.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,80 @@
+"""
+Helpers shared by the tests: parsing and assembling sources into ROM images.
+"""
+
+import os
+
+from src.Assembler._assembler import Assembler as Backend
+from src.Assembler.assembler import Assembler
+from src.Assembler.lexer import Lexer, Token
+from src.Assembler.parser import Parser
+
+
+def parse(source):
+    """
+    Parses high level source text.
+    :rtype: Node
+    """
+
+    token_sequence = Lexer.analyze_string(source)
+    token_sequence.enqueue(Token("EOF", "EOF", len(source)))
+
+    return Parser(token_sequence).parse_lines()
+
+
+def assemble(tmp_path, source, **options):
+    """
+    Assembles assembly source text the way the command line does, through a file.
+    :param tmp_path: directory for the source and the ROM image.
+    :param source: the assembly source.
+    :type source: str
+    :param options: backend flags, eg. optimize_size=True
+    :return: the ROM image.
+    :rtype: bytes
+    """
+
+    source_file = os.path.join(tmp_path, "source.asm")
+    output_file = os.path.join(tmp_path, "output.c8")
+
+    with open(source_file, "w") as file:
+        file.write(source)
+
+    backend = Backend()
+    for name, value in options.items():
+        setattr(backend, name, value)
+
+    backend.read_file(source_file)
+    backend.write_file(output_file)
+
+    with open(output_file, "rb") as file:
+        return file.read()
+
+
+def compile_source(tmp_path, source, superoptimize=False, **options):
+    """
+    Compiles high level source text the way the command line does, through a file.
+    :param tmp_path: directory for the source and the ROM image.
+    :param source: the high level source.
+    :type source: str
+    :param superoptimize: hand short expressions to the superoptimizer.
+    :type superoptimize: bool
+    :param options: backend flags, eg. optimize_size=True
+    :return: the ROM image.
+    :rtype: bytes
+    """
+
+    source_file = os.path.join(tmp_path, "source.c8s")
+    output_file = os.path.join(tmp_path, "output.c8")
+
+    with open(source_file, "w") as file:
+        file.write(source)
+
+    assembler = Assembler()
+    assembler.superoptimize = superoptimize
+    for name, value in options.items():
+        setattr(assembler.backend, name, value)
+
+    assembler.assemble(source_file, output_file)
+
+    with open(output_file, "rb") as file:
+        return file.read()
@@ -0,0 +1,35 @@
+import pytest
+
+from chip8 import run
+from src.Assembler.lexer import Lexer
+from support import compile_source
+
+VALUES = [0x00, 0x01, 0x0F, 0x5A, 0x80, 0xF0, 0xFF]
+
+
+@pytest.mark.parametrize("source, function", [
+    ("V3 = V1&V2;", lambda x, y: x & y),
+    ("V3 = V1|V2;", lambda x, y: x | y),
+    ("V3 = V1^V2;", lambda x, y: x ^ y),
+    ("V3 = V1<<2;", lambda x, y: x << 2 & 0xFF),
+    ("V3 = V1>>3;", lambda x, y: x >> 3),
+    ("V3 = V1 &0x0F;", lambda x, y: x & 0x0F),
+    ("V3 = V1&0x0F|V2<<4;", lambda x, y: (x & 0x0F) | (y << 4 & 0xFF)),
+    ("V3 = (V1)&V2;", lambda x, y: x & y),
+    ("V3 = V1 & V2 ^ V1 | V2;", lambda x, y: ((x & y) ^ x) | y),
+])
+def test_operators_with_and_without_spaces(tmp_path, source, function):
+    rom = compile_source(tmp_path, source)
+
+    for x in VALUES:
+        for y in VALUES:
+            assert run(rom, {1: x, 2: y}).V[3] == function(x, y), (x, y)
+
+
+def test_label_references_start_an_operand():
+    tokens = Lexer.analyze_string("&sprite_2; V3 = V1&V2;").tokens
+
+    assert [(token.type, token.value) for token in tokens] == [
+        ("label_reference", "sprite_2"), ("EOL", ";"), ("register", "V3"),
+        ("assignment_operator", "="), ("register", "V1"), ("bitwise_operator", "&"), ("register", "V2"),
+        ("EOL", ";")]
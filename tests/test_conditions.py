@@ -0,0 +1,57 @@
+import itertools
+
+import pytest
+
+from chip8 import run
+from src.Assembler.lexer import Lexer
+from support import compile_source, parse
+
+VALUES = [0, 1, 2, 0x7F, 0x80, 0xFF]
+
+CONDITIONS = {
+    "V1 == V2": lambda x, y: x == y,
+    "V1 != 2": lambda x, y: x != 2,
+    "V1 < V2": lambda x, y: x < y,
+    "V1 <= V2": lambda x, y: x <= y,
+    "V1 > 0x7F": lambda x, y: x > 0x7F,
+    "V1 >= V2": lambda x, y: x >= y,
+    "V1 == 1 && V2 == 2": lambda x, y: x == 1 and y == 2,
+    "V1 == 1&&V2 == 2": lambda x, y: x == 1 and y == 2,
+    "V1 < V2 || V2 == 0": lambda x, y: x < y or y == 0,
+    "V1==0||V2==0": lambda x, y: x == 0 or y == 0,
+    "(V1 == 1 || V1 == 2) && V2 > V1": lambda x, y: x in (1, 2) and y > x,
+}
+
+
+@pytest.mark.parametrize("condition", CONDITIONS)
+def test_if_else(tmp_path, condition):
+    rom = compile_source(tmp_path, f"IF ({condition}) {{ V3 = 1; }} ELSE {{ V3 = 2; V4 = V4 + 1; }}")
+
+    for x, y in itertools.product(VALUES, repeat=2):
+        expected = 1 if CONDITIONS[condition](x, y) else 2
+        assert run(rom, {1: x, 2: y}).V[3] == expected, (x, y)
+
+
+def test_else_if_chain(tmp_path):
+    rom = compile_source(tmp_path, "IF (V1 < 2) { V3 = 1; } ELSE IF (V1 == 0x80) { V3 = 2; } ELSE { V3 = 3; }")
+
+    for x in VALUES:
+        assert run(rom, {1: x}).V[3] == (1 if x < 2 else 2 if x == 0x80 else 3)
+
+
+def test_logical_operators_need_no_spaces():
+    tokens = Lexer.analyze_string("V1 == 1&&V2 == 2").tokens
+    assert [(token.type, token.value) for token in tokens] == [
+        ("register", "V1"), ("relational_operator", "=="), ("number", "0x1"), ("logical_operator", "&&"),
+        ("register", "V2"), ("relational_operator", "=="), ("number", "0x2")]
+
+
+@pytest.mark.parametrize("source", [
+    "IF (V1 == 1 == 2) { V3 = 1; }",
+    "IF (V1 < V2 != 0) { V3 = 1; }",
+    "IF ((V1 == 1) == 2) { V3 = 1; }",
+    "IF (V1 == (V2 > 1)) { V3 = 1; }",
+])
+def test_comparing_a_comparison_is_an_error(source):
+    with pytest.raises(SyntaxError, match="result of a comparison"):
+        parse(source)
@@ -0,0 +1,87 @@
+import random
+
+import pytest
+
+from chip8 import run
+from src.Assembler.codegen import CodeGenerator
+from support import compile_source, parse
+
+OPERATORS = {
+    "+": lambda x, y: (x + y) % 256,
+    "-": lambda x, y: (x - y) % 256,
+    "&": lambda x, y: x & y,
+    "|": lambda x, y: x | y,
+    "^": lambda x, y: x ^ y,
+}
+
+
+def generate(source):
+    return [" ".join(entry.words) for entry in CodeGenerator().generate(parse(source)) if hasattr(entry, "words")]
+
+
+def test_an_expression_is_copied_from_the_register_holding_it():
+    assert generate("V1 = V2 + V3; V4 = (V2 + V3) + V5;")[:4] == ["LD V1 V2", "ADD V1 V3", "LD V4 V1", "ADD V4 V5"]
+
+
+def test_a_helper_call_is_not_repeated():
+    code = generate("V1 = V2 * V3; V4 = V2 * V3;")
+
+    assert code.count("CALL $__mul8") == 1
+    assert "LD V4 V1" in code
+
+
+@pytest.mark.parametrize("source", [
+    # an operand is written.
+    "V1 = V2 + V3; V2 = 1; V4 = V2 + V3;",
+    # the register holding the value is written.
+    "V1 = V2 + V3; V1 = 0; V4 = V2 + V3;",
+    # a label is a place other code can jump to.
+    "V1 = V2 + V3; IF (V5 == 1) { V6 = 0; } V4 = V2 + V3;",
+])
+def test_the_value_is_forgotten(source):
+    assert "LD V4 V1" not in generate(source)
+
+
+def random_expression(generator, depth=0):
+    # an expression tree over a few leaves, so the same subexpressions show up again and again.
+    if depth > 2 or generator.random() < 0.3:
+        return generator.choice(["V1", "V2", "V3", "7"])
+
+    return (generator.choice(list(OPERATORS)), random_expression(generator, depth + 1),
+            random_expression(generator, depth + 1))
+
+
+def source_of(expression):
+    if isinstance(expression, str):
+        return expression
+
+    operator, left, right = expression
+    return f"({source_of(left)} {operator} {source_of(right)})"
+
+
+def evaluate(expression, registers):
+    if isinstance(expression, str):
+        return registers[int(expression[1])] if expression.startswith("V") else int(expression)
+
+    operator, left, right = expression
+    return OPERATORS[operator](evaluate(left, registers), evaluate(right, registers))
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_programs_compute_the_same(tmp_path, seed):
+    generator = random.Random(seed)
+    registers = {1: 0x12, 2: 0xF0, 3: 0x3C}
+
+    statements = []
+    expected = dict(registers)
+    for _ in range(8):
+        target = generator.choice([1, 2, 3, 4, 5])
+        expression = random_expression(generator)
+        statements.append(f"V{target} = {source_of(expression)};")
+        expected[target] = evaluate(expression, expected)
+
+    rom = compile_source(tmp_path, "\n".join(statements))
+    machine = run(rom, registers)
+
+    for register, value in expected.items():
+        assert machine.V[register] == value, statements
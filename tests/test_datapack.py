@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+from chip8 import run
+from src.Assembler.datapack import pack_strings
+from support import assemble
+
+BLOCKS = {
+    "first": "01 02 03 04",
+    "overlapping": "03 04 05 06",
+    "inside": "02 03",
+    "same": "01 02 03 04",
+    "alone": "AA",
+    "tail": "06 07",
+}
+
+
+def check_packing(strings):
+    storage, offsets = pack_strings(strings)
+
+    for index, string in enumerate(strings):
+        assert storage[offsets[index]:offsets[index] + len(string)] == string
+
+    assert len(storage) <= sum(len(string) for string in strings)
+    return storage
+
+
+def test_pack_strings():
+    assert check_packing([b"ABC", b"BCD"]) == b"ABCD"
+    assert check_packing([b"ABCD", b"BC"]) == b"ABCD"
+    assert len(check_packing([b"XY", b"YZ", b"ZX"])) == 4  # the chain doesn't close into a cycle.
+    assert len(check_packing([b"12", b"34"])) == 4
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_every_string_is_found_at_its_offset(seed):
+    generator = random.Random(seed)
+    strings = {bytes(generator.randrange(3) for _ in range(generator.randrange(1, 8)))
+               for _ in range(generator.randrange(1, 12))}
+
+    check_packing(sorted(strings))
+
+
+def program(label):
+    # reads the block of the label into V0 and up, then stops.
+    source = f"LD I ${label}\nLD V{len(BLOCKS[label].split()) - 1:X} [I]\nend:\nJP $end\n"
+    return source + "".join(f"{name}:\n.db {contents}\n" for name, contents in BLOCKS.items())
+
+
+@pytest.mark.parametrize("label", BLOCKS)
+def test_every_label_points_at_its_bytes(tmp_path, label):
+    plain = assemble(tmp_path, program(label))
+    packed = assemble(tmp_path, program(label), pack_data=True)
+
+    # first and same are stored once, inside is in first, overlapping shares 03 04 and tail shares 06.
+    assert len(plain) - len(packed) == 4 + 2 + 2 + 1
+
+    contents = [int(value, 16) for value in BLOCKS[label].split()]
+    assert run(plain).V[:len(contents)] == contents
+    assert run(packed).V[:len(contents)] == contents
@@ -0,0 +1,57 @@
+import pytest
+
+from chip8 import run
+from src.Assembler.cfg import eliminate_dead_code
+from src.Assembler.ir import Data, Instruction, Label
+from support import assemble
+
+REGISTERS = {1: 0x12, 2: 0x34}
+
+
+def test_unreachable_code_and_unused_data_are_removed():
+    buffer = [Instruction(["LD", "I", "$used"]), Instruction(["CALL", "$function"]), Label("end"),
+              Instruction(["JP", "$end"]), Instruction(["ADD", "V1", "#01"]), Label("function"),
+              Instruction(["RET"]), Label("unused_function"), Instruction(["RET"]), Label("used"),
+              Data(b"\x01\x02"), Label("unused"), Data(b"\x03")]
+
+    new_buffer, removed = eliminate_dead_code(buffer)
+
+    assert [entry.name for entry in new_buffer if isinstance(entry, Label)] == ["end", "function", "used"]
+    assert sum(len(block) for block in removed) == 2 + 2 + 1
+    assert len(new_buffer) == len(buffer) - 5
+
+
+def test_roots_are_kept():
+    buffer = [Label("end"), Instruction(["JP", "$end"]), Label("exported"), Instruction(["RET"])]
+
+    assert eliminate_dead_code(buffer)[1]
+    assert eliminate_dead_code(buffer, ["exported"]) == (buffer, [])
+
+
+def test_numeric_addresses_turn_it_off():
+    # JP 0x204 could land anywhere, nothing is removed.
+    buffer = [Instruction(["JP", "0x204"]), Instruction(["ADD", "V1", "#01"]), Instruction(["RET"])]
+
+    assert eliminate_dead_code(buffer) == (buffer, [])
+
+
+SOURCES = [
+    # code after a jump, and a subroutine nothing calls.
+    "ADD V1 #03\nJP $main\nADD V1 #10\nunused:\nADD V2 #01\nRET\nmain:\nXOR V2 V1\nend:\nJP $end\n",
+    # both sides of a skip are reachable.
+    "SE V1 #12\nJP $other\nADD V1 #01\nJP $end\nother:\nADD V2 #01\nend:\nJP $end\nADD V1 #05\n",
+    # a called subroutine and the sprite it draws stay, the data after them goes.
+    "CALL $draw\nend:\nJP $end\ndraw:\nLD I $sprite\nADD V1 V2\nRET\nsprite:\n.db F0 90 F0\nspare:\n.db 01 02\n",
+]
+
+
+@pytest.mark.parametrize("source", SOURCES)
+def test_programs_behave_the_same(tmp_path, source):
+    plain = assemble(tmp_path, source)
+    trimmed = assemble(tmp_path, source, eliminate_dead_code=True)
+
+    assert len(trimmed) < len(plain)
+
+    expected, actual = run(plain, REGISTERS), run(trimmed, REGISTERS)
+    assert actual.V == expected.V
+    assert actual.memory[actual.I:actual.I + 3] == expected.memory[expected.I:expected.I + 3]
@@ -0,0 +1,68 @@
+import pytest
+
+from chip8 import run
+from src.Assembler.codegen import CodeGenerator
+from support import compile_source, parse
+
+
+def switch(values, subject="V1", default=True):
+    cases = " ".join(f"CASE {value} {{ V3 = {count + 1}; }}" for count, value in enumerate(values))
+    return f"SWITCH ({subject}) {{ {cases} {'DEFAULT { V3 = 99; }' if default else ''} }}"
+
+
+def else_if_chain(values):
+    return " ELSE ".join(f"IF (V1 == {value}) {{ V3 = {count + 1}; }}" for count, value in enumerate(values))
+
+
+def expected(values, subject, default=True):
+    if subject in values:
+        return values.index(subject) + 1
+
+    return 99 if default else 0
+
+
+def mnemonics(source):
+    return [" ".join(entry.words[:2]) for entry in CodeGenerator().generate(parse(source)) if hasattr(entry, "words")]
+
+
+DENSE = [0, 1, 2, 4, 5]
+SPARSE = [1, 20, 90, 200, 250]
+
+
+@pytest.mark.parametrize("values, table", [(DENSE, True), ([3, 4, 5, 6, 7], True), (SPARSE, False)])
+@pytest.mark.parametrize("default", [True, False])
+def test_switch(tmp_path, values, table, default):
+    source = switch(values, default=default)
+    assert ("JP V0" in mnemonics(source)) == table
+
+    rom = compile_source(tmp_path, source)
+    for subject in range(256):
+        assert run(rom, {1: subject}).V[3] == expected(values, subject, default), subject
+
+
+@pytest.mark.parametrize("values, table", [([3, 4, 5, 6], True), ([2, 40, 80, 160, 255], False)])
+def test_else_if_chains_dispatch_like_a_switch(tmp_path, values, table):
+    source = else_if_chain(values)
+    assert ("JP V0" in mnemonics(source)) == table
+
+    rom = compile_source(tmp_path, source)
+    for subject in range(256):
+        assert run(rom, {1: subject}).V[3] == expected(values, subject, default=False), subject
+
+
+def test_v0_survives_a_jump_table(tmp_path):
+    # the program uses V0 itself, the jump table saves it in a scratch register and every case gets it back.
+    rom = compile_source(tmp_path, switch(DENSE) + " V4 = V0 + 1;")
+
+    for subject in (0, 4, 7):
+        machine = run(rom, {0: 0x42, 1: subject})
+        assert machine.V[0] == 0x42
+        assert machine.V[4] == 0x43
+        assert machine.V[3] == expected(DENSE, subject)
+
+
+def test_the_subject_can_be_an_expression(tmp_path):
+    rom = compile_source(tmp_path, switch(DENSE, subject="V1 + V2"))
+
+    for x, y in [(0, 0), (1, 1), (3, 2), (0xFF, 1), (0x80, 0x80), (9, 9)]:
+        assert run(rom, {1: x, 2: y}).V[3] == expected(DENSE, (x + y) % 256)
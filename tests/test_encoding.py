@@ -0,0 +1,38 @@
+import io
+from contextlib import redirect_stdout
+
+import pytest
+
+from src.Assembler._assembler import Assembler
+
+
+@pytest.fixture(scope="module")
+def backend():
+    with redirect_stdout(io.StringIO()):
+        return Assembler()
+
+
+@pytest.mark.parametrize("words, opcode", [
+    ("LD V1 #1F", "611F"),
+    ("LD V1 V2", "8120"),
+    ("LD I 0x20", "A020"),
+    ("ADD V3 #01", "7301"),
+    ("ADD V3 V4", "8344"),
+    ("ADD I V2", "F21E"),
+    ("AND V1 V2", "8122"),
+    ("OR V1 V2", "8121"),
+    ("XOR V1 V2", "8123"),
+    ("SUB V1 V2", "8125"),
+    ("SUBN V1 V2", "8127"),
+    ("SHL V3", "833E"),
+    ("SHR V3 V3", "8336"),
+    ("JP 0x20", "1020"),
+    ("JP V0 0x234", "B234"),
+    ("CALL 0x300", "2300"),
+    ("SE V1 #02", "3102"),
+    ("SNE V1 V2", "9120"),
+    ("CLS", "00E0"),
+    ("RET", "00EE"),
+])
+def test_encoding(backend, words, opcode):
+    assert backend.fetch_opcode(words.split()).upper() == opcode
@@ -0,0 +1,66 @@
+import pytest
+
+from support import assemble
+
+
+@pytest.fixture
+def blob(tmp_path):
+    path = tmp_path / "blob.bin"
+    path.write_bytes(bytes(range(256)) * 4)
+    return path
+
+
+def test_includes_the_whole_file(tmp_path, blob):
+    rom = assemble(tmp_path, f'CLS\n.incbin "{blob}"\n')
+
+    assert rom[:2] == b"\x00\xE0"
+    assert rom[2:] == blob.read_bytes()
+
+
+def test_includes_a_range_in_hex(tmp_path, blob):
+    rom = assemble(tmp_path, f'CLS\n.incbin "{blob}" 10 0x20\n')
+
+    # directive numbers are hex like the bytes of .db, 10 is 0x10.
+    assert rom[2:] == bytes(range(0x10, 0x30))
+
+
+def test_decimal_after_a_hash(tmp_path, blob):
+    rom = assemble(tmp_path, f'CLS\n.incbin "{blob}" #10 #4\n')
+
+    assert rom[2:] == bytes(range(10, 14))
+
+
+def test_db_and_incbin_read_numbers_alike(tmp_path):
+    assert assemble(tmp_path, "CLS\n.db 10 #10 0x10\n")[2:] == bytes([0x10, 10, 0x10])
+
+
+def test_range_past_the_end_of_the_file(tmp_path, blob):
+    with pytest.raises(ValueError, match="past the end"):
+        assemble(tmp_path, f'CLS\n.incbin "{blob}" 3F0 20\n')
+
+
+def test_checked_against_the_final_layout(tmp_path):
+    # the first pass places this blob at 0x203 - 0xFFF, but the data before the first instruction gets a jump over it,
+    # which moves the blob 2 bytes up and past the end of memory.
+    path = tmp_path / "full.bin"
+    path.write_bytes(bytes(0x1000 - 0x203))
+
+    with pytest.raises(ValueError, match=r"\.incbin of .* does not fit in memory"):
+        assemble(tmp_path, f'.db 1\nCLS\n.incbin "{path}"\n')
+
+    # with an instruction first there is no jump, and the blob ends right at 0xFFF.
+    assert len(assemble(tmp_path, f'CLS\n.db 1\n.incbin "{path}"\n')) == 0x1000 - 0x200
+
+
+@pytest.mark.parametrize("parameters, message", [("-2", "offset -2 is negative"), ("0 -1", "length -1 is negative")])
+def test_negative_offset_and_length(tmp_path, blob, parameters, message):
+    with pytest.raises(ValueError, match=message):
+        assemble(tmp_path, f'CLS\n.incbin "{blob}" {parameters}\n')
+
+
+def test_commas_in_quoted_file_names(tmp_path):
+    path = tmp_path / "level,1.bin"
+    path.write_bytes(b"\x01\x02\x03")
+
+    # the commas between the parameters are dropped like the ones between operands.
+    assert assemble(tmp_path, f'CLS\n.incbin "{path}", 1, 2\n')[2:] == b"\x02\x03"
@@ -0,0 +1,36 @@
+import pytest
+
+from src.Assembler.lexer import PARALLEL_MIN_WORKERS, Lexer
+
+SOURCE = "V1 = (V2 + 0x10) * 3;\nIF (V1 == 2) { V3 = V3 + 1; }\nWHILE (V4 < 10) { V4 = V4 + 1; }\n" * 200
+
+
+def contents(token_sequence):
+    return [(token.type, token.value, token.offset) for token in token_sequence.tokens]
+
+
+def test_chunks_end_at_statement_boundaries():
+    chunks = Lexer.split_statements(SOURCE, 7)
+
+    assert "".join(chunks) == SOURCE
+    assert all(chunk[-1] in ";\n" for chunk in chunks)
+
+
+def test_parallel_lexing_gives_the_serial_tokens():
+    assert contents(Lexer.analyze_string_parallel(SOURCE, 3)) == contents(Lexer.analyze_string(SOURCE))
+
+
+@pytest.mark.parametrize("threshold, workers, parallel", [
+    (len(SOURCE), PARALLEL_MIN_WORKERS, True),
+    (len(SOURCE) + 1, PARALLEL_MIN_WORKERS, False),
+    (len(SOURCE), PARALLEL_MIN_WORKERS - 1, False),
+    (None, PARALLEL_MIN_WORKERS, False),
+])
+def test_when_lexing_is_parallel(monkeypatch, threshold, workers, parallel):
+    calls = []
+    monkeypatch.setattr(Lexer, "analyze_string_parallel",
+                        staticmethod(lambda string, count: calls.append(count) or Lexer.analyze_string(string)))
+
+    Lexer(parallel_threshold=threshold, workers=workers).analyze(SOURCE)
+
+    assert calls == ([workers] if parallel else [])
@@ -0,0 +1,134 @@
+import os
+
+import pytest
+
+from chip8 import run
+from src.Assembler.linker import link
+from src.Assembler.objectfile import ObjectFile
+from support import assemble
+
+MAIN = """
+LD V1 #05
+CALL $triple
+LD I $table
+end:
+JP $end
+table:
+.db 01 02 03
+"""
+
+TRIPLE = """
+triple:
+LD V2 V1
+ADD V1 V2
+ADD V1 V2
+LD I $factor
+RET
+factor:
+.db 03
+"""
+
+
+def compile_module(tmp_path, name, source, **options):
+    # assembles one module with compile only, through an object file on disk.
+    directory = tmp_path / name
+    directory.mkdir()
+
+    assemble(directory, source, compile_only=True, **options)
+    return ObjectFile.read(os.path.join(directory, "output.c8"))
+
+
+def test_object_files_round_trip(tmp_path):
+    module = compile_module(tmp_path, "main", MAIN)
+
+    module.write(tmp_path / "copy.o")
+    copy = ObjectFile.read(tmp_path / "copy.o")
+
+    assert copy.sections == module.sections
+    assert [(symbol.name, symbol.section, symbol.offset, symbol.is_global) for symbol in copy.symbols] == \
+           [(symbol.name, symbol.section, symbol.offset, symbol.is_global) for symbol in module.symbols]
+    assert [(entry.section, entry.offset, entry.symbol) for entry in copy.relocations] == \
+           [(entry.section, entry.offset, entry.symbol) for entry in module.relocations]
+
+
+def test_not_an_object_file(tmp_path):
+    (tmp_path / "image.c8").write_bytes(b"\x00\xe0\x12\x00")
+
+    with pytest.raises(ValueError, match="not an object file"):
+        ObjectFile.read(tmp_path / "image.c8")
+
+
+def test_a_single_module_links_to_the_assembled_image(tmp_path):
+    # with its data at the end already, linking moves nothing.
+    main_code, main_data = MAIN.split("table:")
+    source = main_code + "triple:\nRET\ntable:" + main_data
+
+    image, symbols = link([compile_module(tmp_path, "main", source)])
+
+    assert image == assemble(tmp_path, source)
+    assert symbols["table"] == 0x200 + 5 * 2
+
+
+def test_modules_link_like_one_source(tmp_path):
+    # the code of every module comes first, then the data of every module, in the order they are given.
+    image, symbols = link([compile_module(tmp_path, "main", MAIN), compile_module(tmp_path, "triple", TRIPLE)])
+
+    main_code, main_data = MAIN.split("table:")
+    triple_code, triple_data = TRIPLE.split("factor:")
+    single = assemble(tmp_path, main_code + triple_code + "table:" + main_data + "factor:" + triple_data)
+
+    assert image == single
+    assert set(symbols) == {"end", "table", "triple", "factor"}
+
+    machine = run(image)
+    assert machine.V[1] == 15
+    assert machine.memory[machine.I:machine.I + 3] == bytes([1, 2, 3])
+
+
+def test_local_labels_stay_in_their_module(tmp_path):
+    first = "CALL $count\n__loop:\nJP $__loop\n"
+    second = "count:\nLD V1 #00\n__loop:\nADD V1 #01\nSE V1 #04\nJP $__loop\nRET\n"
+
+    image, symbols = link([compile_module(tmp_path, "first", first), compile_module(tmp_path, "second", second)])
+
+    assert "__loop" not in symbols
+    assert run(image).V[1] == 4
+
+
+def test_undefined_symbol(tmp_path):
+    with pytest.raises(ValueError, match="Undefined symbol triple"):
+        link([compile_module(tmp_path, "main", MAIN)])
+
+
+def test_symbol_defined_twice(tmp_path):
+    modules = [compile_module(tmp_path, "main", MAIN), compile_module(tmp_path, "triple", TRIPLE),
+               compile_module(tmp_path, "again", TRIPLE)]
+
+    with pytest.raises(ValueError, match="Symbol triple is defined in both"):
+        link(modules)
+
+
+def test_relocations_are_patched(tmp_path):
+    image, symbols = link([compile_module(tmp_path, "main", MAIN), compile_module(tmp_path, "triple", TRIPLE)])
+
+    # CALL triple and LD I table, the words point at the symbols.
+    assert int.from_bytes(image[2:4], "big") == 0x2000 | symbols["triple"]
+    assert int.from_bytes(image[4:6], "big") == 0xA000 | symbols["table"]
+
+
+def test_data_first_needs_no_jump_in_an_object_file(tmp_path):
+    # the data goes to its own section, after all the code, so nothing has to jump over it.
+    module = compile_module(tmp_path, "main", "table:\n.db 01 02\nstart:\nLD I $table\nend:\nJP $end\n")
+
+    assert len(module.sections[0]) == 2 * 2
+    assert [module.symbols[entry.symbol].name for entry in module.relocations] == ["table", "end"]
+
+    image, symbols = link([module])
+    assert run(image).I == symbols["table"] == 0x204
+
+
+def test_symbol_names_longer_than_255_bytes(tmp_path):
+    name = "label_" + "x" * 250
+
+    with pytest.raises(ValueError, match=f"Symbol {name} is too long"):
+        compile_module(tmp_path, "main", f"{name}:\nJP ${name}\n")
@@ -0,0 +1,32 @@
+import pytest
+
+from chip8 import run
+from support import compile_source
+
+
+@pytest.mark.parametrize("source, registers, expected", [
+    # V1, V2 and V3 after the loop.
+    ("WHILE (V1 < V3) { V1 = V1 + 1; V2 = V2 + 2; }", {3: 7}, [7, 14, 7]),
+    ("WHILE (V1 < V3) { V1 = V1 + 1; V2 = V2 + 2; }", {1: 9, 3: 7}, [9, 0, 7]),
+    ("WHILE (V1 != 0) { V1 = V1 - 1; V2 = V2 + V3; }", {1: 5, 3: 3}, [0, 15, 3]),
+    ("WHILE (V1 < 4 && V2 < 10) { V1 = V1 + 1; V2 = V2 + 3; }", {}, [4, 12, 0]),
+    ("FOR (V1 = 0; V1 < 10; V1 = V1 + 1) { V2 = V2 + 2; }", {}, [10, 20, 0]),
+    ("FOR (V1 = 0; V1 < 10; V1 = V1 + 3) { V2 = V2 + V1; }", {}, [12, 18, 0]),
+    ("FOR (V1 = 10; V1 > 0; V1 = V1 - 1) { V2 = V2 + 1; }", {}, [0, 10, 0]),
+    ("FOR (V1 = 5; V1 < 3; V1 = V1 + 1) { V2 = V2 + 1; }", {}, [5, 0, 0]),
+    ("FOR (V1 = 0; V1 < V3; V1 = V1 + 2) { V2 = V2 + 1; }", {3: 9}, [10, 5, 9]),
+    ("FOR (V1 = 0; V1 < 4; V1 = V1 + 1) { FOR (V2 = 0; V2 < 3; V2 = V2 + 1) { V3 = V3 + 1; } }", {}, [4, 3, 12]),
+])
+def test_loops(tmp_path, source, registers, expected):
+    rom = compile_source(tmp_path, source)
+    assert run(rom, registers).V[1:4] == expected
+
+
+def test_an_iteration_costs_a_skip_and_a_jump(tmp_path):
+    # the body is one ADD, every iteration runs it, the step, and the skip and jump at the bottom.
+    steps = {}
+    for bound in (5, 10):
+        rom = compile_source(tmp_path, f"FOR (V1 = 0; V1 < {bound}; V1 = V1 + 1) {{ V2 = V2 + 2; }}")
+        steps[bound] = run(rom).steps
+
+    assert steps[10] - steps[5] == 5 * 4
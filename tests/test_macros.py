@@ -0,0 +1,63 @@
+import pytest
+
+from chip8 import run
+from support import assemble
+
+END = "end:\nJP $end\n"
+
+
+def test_a_macro_expands_to_its_body(tmp_path):
+    source = ".macro add_twice register value\nADD \\register \\value\nADD \\register \\value\n.endm\n" \
+             "add_twice V1 #03\nadd_twice V2 #10\n" + END
+
+    assert assemble(tmp_path, source) == assemble(tmp_path, "ADD V1 #03\nADD V1 #03\nADD V2 #10\nADD V2 #10\n" + END)
+
+
+def test_labels_are_unique_to_every_expansion(tmp_path):
+    # counts the register down to 0, adding 2 to V2 every time round.
+    source = ".macro count register\nloop_\\@:\nADD V2 #02\nADD \\register #FF\nSE \\register #00\n" \
+             "JP $loop_\\@\n.endm\ncount V1\ncount V3\n" + END
+
+    machine = run(assemble(tmp_path, source), {1: 3, 3: 5})
+    assert (machine.V[1], machine.V[2], machine.V[3]) == (0, 16, 0)
+
+
+def test_the_repeat_counter_is_hex(tmp_path):
+    source = ".rept 10 i\nLD V\\i #\\i\n.endr\n" + END
+
+    assert run(assemble(tmp_path, source)).V == list(range(16))
+
+
+def test_repeat_counts(tmp_path):
+    hex_count = assemble(tmp_path, ".rept 10\nADD V1 #01\n.endr\n" + END)
+    decimal_count = assemble(tmp_path, ".rept #10\nADD V1 #01\n.endr\n" + END)
+
+    assert run(hex_count).V[1] == 16
+    assert run(decimal_count).V[1] == 10
+
+
+def test_repeats_and_macros_nest(tmp_path):
+    source = ".macro fill count value\n.rept \\count\nADD V1 \\value\n.endr\n.endm\n" \
+             ".rept 3\nfill 2 #05\n.endr\n" + END
+
+    assert run(assemble(tmp_path, source)).V[1] == 3 * 2 * 5
+
+
+def test_macros_use_other_macros(tmp_path):
+    source = ".macro double register\nADD \\register \\register\n.endm\n" \
+             ".macro quadruple register\ndouble \\register\ndouble \\register\n.endm\nquadruple V1\n" + END
+
+    assert run(assemble(tmp_path, source), {1: 3}).V[1] == 12
+
+
+@pytest.mark.parametrize("source, message", [
+    (".macro add register value\nADD \\register \\value\n.endm\nadd V1\n", "takes 2 arguments"),
+    (".macro loop\nloop\n.endm\nloop\n", "nested more than"),
+    (".macro open\nCLS\n", "without a matching .endm"),
+    (".rept 2\nCLS\n", "without a matching .endr"),
+    ("CLS\n.endm\n", ".endm without a matching .macro"),
+    (".rept 2\n.macro inner\n.endm\n.endr\n", "can't be defined inside"),
+])
+def test_errors(tmp_path, source, message):
+    with pytest.raises(ValueError, match=message):
+        assemble(tmp_path, source + END)
@@ -0,0 +1,91 @@
+import random
+
+import pytest
+
+from chip8 import run
+from src.Assembler.outliner import lcp_array, suffix_array
+from support import assemble
+
+REGISTERS = {1: 0x12, 2: 0x34, 3: 0x56, 4: 0x78}
+
+
+def test_suffix_and_lcp_arrays():
+    generator = random.Random(30)
+
+    for _ in range(50):
+        sequence = [generator.randrange(4) for _ in range(generator.randrange(1, 60))]
+        suffixes = suffix_array(sequence)
+
+        assert suffixes == sorted(range(len(sequence)), key=lambda index: sequence[index:])
+
+        lcp = lcp_array(sequence, suffixes)
+        for count in range(1, len(sequence)):
+            first, second = sequence[suffixes[count - 1]:], sequence[suffixes[count]:]
+            common = 0
+            while common < min(len(first), len(second)) and first[common] == second[common]:
+                common += 1
+            assert lcp[count] == common
+
+
+def random_program(generator):
+    # straight line chunks repeated all over, with skips and labels in between.
+    chunks = [[f"{generator.choice(['ADD', 'SUB', 'XOR', 'OR', 'AND'])} V{generator.randrange(1, 5)} "
+               f"V{generator.randrange(1, 5)}" if generator.random() < 0.5 else
+               f"ADD V{generator.randrange(1, 5)} #{generator.randrange(256):02X}"
+               for _ in range(generator.randrange(2, 6))] for _ in range(3)]
+
+    lines = []
+    for count in range(generator.randrange(4, 12)):
+        lines += generator.choice(chunks)
+        if generator.random() < 0.3:
+            lines.append(f"SE V{generator.randrange(1, 5)} #{generator.randrange(4):02X}")
+        if generator.random() < 0.3:
+            lines.append(f"label_{count}:")
+
+    return "\n".join(lines + ["end:", "JP $end"]) + "\n"
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_outlined_programs_behave_the_same(tmp_path, seed):
+    source = random_program(random.Random(seed))
+
+    plain = assemble(tmp_path, source)
+    outlined = assemble(tmp_path, source, optimize_size=True)
+
+    assert len(outlined) <= len(plain)
+    assert run(outlined, REGISTERS).V[:5] == run(plain, REGISTERS).V[:5]
+
+
+def test_repeats_become_subroutines(tmp_path):
+    body = "ADD V1 #01\nXOR V2 V1\nSHL V2\nADD V3 V2\n"
+    source = body * 4 + "end:\nJP $end\n"
+
+    plain = assemble(tmp_path, source)
+    outlined = assemble(tmp_path, source, optimize_size=True)
+
+    # 4 CALLs and the subroutine (4 instructions and a RET) instead of 16 instructions.
+    assert len(plain) - len(outlined) == 2 * (16 - 4 - 5)
+    assert run(outlined).V[:4] == run(plain).V[:4]
+
+
+@pytest.mark.parametrize("ending, length", [
+    ("", 0),
+    # the skip could jump over the JP at the end, so the program can still run past it.
+    ("SNE V1 #04\nend:\nJP $end\n", 2),
+])
+def test_programs_running_past_their_end_stop_before_the_subroutines(tmp_path, ending, length):
+    # without the guard the program runs into the subroutine and returns with an empty stack.
+    body = "ADD V1 #01\nXOR V2 V1\nSHL V2\nADD V3 V2\n"
+    outlined = assemble(tmp_path, body * 4 + ending, optimize_size=True)
+    expected = run(assemble(tmp_path, body * 4 + "stop:\nJP $stop\n"))
+
+    # 4 CALLs, the ending, the guard and the subroutine instead of 16 instructions.
+    assert len(outlined) == 2 * 4 + length * 2 + 2 + 2 * 5
+    assert run(outlined).V[:4] == expected.V[:4]
+
+
+def test_no_guard_after_a_jump(tmp_path):
+    body = "ADD V1 #01\nXOR V2 V1\nSHL V2\nADD V3 V2\n"
+    outlined = assemble(tmp_path, body * 4 + "end:\nJP $end\n", optimize_size=True)
+
+    assert len(outlined) == 2 * 4 + 2 + 2 * 5
@@ -0,0 +1,34 @@
+import pytest
+
+from src.Assembler.lexer import Lexer, SourceMap
+from support import parse
+
+
+def test_locations_are_one_based():
+    source_map = SourceMap("V1 = 1;\n\nV2 = V1 + 3;\n")
+
+    assert source_map.location(0) == (1, 1)
+    assert source_map.location(8) == (2, 1)
+    assert source_map.location(14) == (3, 6)
+    assert source_map.line_text(3) == "V2 = V1 + 3;"
+
+
+def test_the_index_is_only_built_when_asked_for():
+    token_sequence = Lexer.analyze_string("V1 = 1;\n" * 100)
+
+    assert token_sequence.source_map._SourceMap__line_starts is None
+    assert token_sequence.source_map.location(token_sequence.tokens[-1].offset) == (100, 7)
+
+
+def test_tokens_keep_their_offsets():
+    source = "V1 = 0x10;\nV2 = V1;"
+
+    assert [token.offset for token in Lexer.analyze_string(source).tokens] == [0, 3, 5, 9, 11, 14, 16, 18]
+
+
+def test_syntax_errors_point_at_the_token():
+    with pytest.raises(SyntaxError) as error:
+        parse("V1 = 1;\nV2 = V1 + ;\n")
+
+    assert (error.value.lineno, error.value.offset) == (2, 11)
+    assert error.value.text == "V2 = V1 + ;"
@@ -0,0 +1,89 @@
+import pytest
+
+from src.Assembler import sprites
+from support import assemble
+
+
+@pytest.fixture(autouse=True)
+def cache_directory(tmp_path, monkeypatch):
+    # every test starts with empty caches, and never touches the real one.
+    monkeypatch.setattr(sprites, "CACHE_DIRECTORY", str(tmp_path / "cache"))
+    monkeypatch.setattr(sprites, "_tile_cache", {})
+
+
+def plain_pbm(rows):
+    return f"P1\n# comment\n{len(rows[0])} {len(rows)}\n".encode() + "\n".join(rows).encode() + b"\n"
+
+
+def test_plain_and_raw_pbm_decode_the_same():
+    rows = ["10000001", "01111110", "00000000"]
+    raw = b"P4\n8 3\n" + bytes(int(row, 2) for row in rows)
+
+    assert (sprites.load_pixels(plain_pbm(rows)) == sprites.load_pixels(raw)).all()
+
+
+def test_pgm_threshold():
+    image = b"P2\n4 1\n255\n0 100 200 255\n"
+
+    assert sprites.load_pixels(image).tolist() == [[True, True, False, False]]
+    assert sprites.load_pixels(image, 101).tolist() == [[True, True, False, False]]
+    assert sprites.load_pixels(image, 50).tolist() == [[True, False, False, False]]
+
+
+def test_tiles_are_8_wide_and_15_tall():
+    # 10 x 17: two strips, the second padded with zeros, and a band of 15 rows then one of 2.
+    rows = ["1" * 10] * 17
+    tiles = sprites.slice_tiles(sprites.load_pixels(plain_pbm(rows)))
+
+    assert [len(tile) for tile in tiles] == [15, 15, 2, 2]
+    assert tiles[0] == b"\xFF" * 15
+    assert tiles[1] == b"\xC0" * 15
+
+
+def test_tiles_are_cached_across_runs(tmp_path, monkeypatch):
+    image = tmp_path / "ship.pbm"
+    image.write_bytes(plain_pbm(["10101010", "01010101"] * 9))
+
+    tiles = sprites.load_tiles(str(image))
+
+    # a later run starts with an empty memory cache, the tiles come from the cache file without converting.
+    monkeypatch.setattr(sprites, "_tile_cache", {})
+    monkeypatch.setattr(sprites, "slice_tiles", lambda pixels: pytest.fail("converted again"))
+
+    assert sprites.load_tiles(str(image)) == tiles
+
+
+def test_cache_is_keyed_by_contents_and_threshold(tmp_path):
+    image = tmp_path / "gray.pgm"
+    image.write_bytes(b"P2\n8 1\n255\n0 32 64 96 128 160 192 224\n")
+
+    assert sprites.load_tiles(str(image), 0x80) == [b"\xF0"]
+    assert sprites.load_tiles(str(image), 0x40) == [b"\xC0"]
+
+    image.write_bytes(b"P2\n8 1\n255\n255 0 0 0 0 0 0 0\n")
+    assert sprites.load_tiles(str(image), 0x80) == [b"\x7F"]
+
+
+def test_sprite_directive_labels_every_tile(tmp_path):
+    image = tmp_path / "ship.pbm"
+    image.write_bytes(plain_pbm(["1" * 16] * 2))
+
+    rom = assemble(tmp_path, f'LD I, $ship_1\nCLS\n.sprite "{image}"\n')
+
+    # ship_0 is at 0x204 and ship_1 right after its 2 rows.
+    assert rom[:2] == b"\xA2\x06"
+    assert rom[4:] == b"\xFF" * 4
+
+
+def test_cache_files_of_another_version_are_not_read(tmp_path, monkeypatch):
+    image = tmp_path / "ship.pbm"
+    image.write_bytes(plain_pbm(["11110000"] * 2))
+
+    sprites.load_tiles(str(image))
+
+    # a new version converts the image again, even though a file of the old version is there.
+    monkeypatch.setattr(sprites, "_tile_cache", {})
+    monkeypatch.setattr(sprites, "CACHE_VERSION", sprites.CACHE_VERSION + 1)
+    monkeypatch.setattr(sprites, "slice_tiles", lambda pixels: [b"\x01"])
+
+    assert sprites.load_tiles(str(image)) == [b"\x01"]
@@ -0,0 +1,58 @@
+import pytest
+
+from chip8 import run
+from support import compile_source
+
+VALUES = [0x00, 0x01, 0x07, 0x12, 0x7F, 0x80, 0xC9, 0xFF]
+
+
+def calls(rom):
+    # the number of CALL instructions in the ROM image, every one of them is a helper call here.
+    return sum(1 for count in range(0, len(rom) - 1, 2) if rom[count] >> 4 == 0x2)
+
+
+@pytest.mark.parametrize("constant", [0, 1, 2, 3, 5, 7, 10, 16, 255])
+def test_multiplying_by_a_constant(tmp_path, constant):
+    rom = compile_source(tmp_path, f"V3 = V1 * {constant};")
+    assert calls(rom) == 0
+
+    for value in VALUES:
+        assert run(rom, {1: value}).V[3] == value * constant % 256
+
+
+@pytest.mark.parametrize("constant", [1, 2, 8, 128])
+@pytest.mark.parametrize("operator", ["/", "%"])
+def test_dividing_by_a_power_of_two(tmp_path, operator, constant):
+    rom = compile_source(tmp_path, f"V3 = V1 {operator} {constant};")
+    assert calls(rom) == 0
+
+    for value in VALUES:
+        expected = value // constant if operator == "/" else value % constant
+        assert run(rom, {1: value}).V[3] == expected
+
+
+@pytest.mark.parametrize("source, function", [
+    ("V3 = V1 * V2;", lambda x, y: x * y % 256),
+    ("V3 = V1 / V2;", lambda x, y: x // y),
+    ("V3 = V1 % V2;", lambda x, y: x % y),
+    ("V3 = V1 / 3;", lambda x, y: x // 3),
+    ("V3 = V1 % 10;", lambda x, y: x % 10),
+    ("V3 = (V1 / V2) * (V1 % V2);", lambda x, y: (x // y) * (x % y) % 256),
+])
+def test_helpers(tmp_path, source, function):
+    rom = compile_source(tmp_path, source)
+    assert calls(rom)
+
+    for x in VALUES:
+        for y in VALUES[1:]:
+            assert run(rom, {1: x, 2: y}).V[3] == function(x, y)
+
+
+def test_scratch_registers_are_taken_from_ve_down(tmp_path):
+    # the helpers reserve three scratch registers, V0 is left alone for a jump table.
+    rom = compile_source(tmp_path, "V3 = V1 * V2;")
+    machine = run(rom, {0: 0x55, 1: 0x03, 2: 0x04, 4: 0x66})
+
+    assert machine.V[0] == 0x55
+    assert machine.V[4] == 0x66
+    assert machine.V[3] == 0x0C
@@ -0,0 +1,129 @@
+import json
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from chip8 import run
+from src.Assembler import superopt
+from src.Assembler.superopt import Superoptimizer
+from support import compile_source
+
+VALUES = [0x00, 0x01, 0x02, 0x55, 0x7F, 0x80, 0xAA, 0xFE, 0xFF]
+
+
+@pytest.fixture(autouse=True)
+def memo_file(tmp_path, monkeypatch):
+    # every test starts with an empty memo table of its own.
+    memo_file = str(tmp_path / "superoptimizer.json")
+    monkeypatch.setattr(superopt, "MEMO_FILE", memo_file)
+    return memo_file
+
+
+def search(function, input_count, target_input=None, constants=(), max_length=3):
+    sequence, shortest = Superoptimizer().search(function, input_count, target_input, set(constants), max_length)
+
+    # the searches here are small enough to be exact.
+    assert shortest
+    return sequence
+
+
+def test_the_empty_sequence_comes_first():
+    # t already holds a, nothing to do.
+    assert search(lambda values: values[0] ^ values[1] ^ values[1], 2, target_input=0) == []
+    assert search(lambda values: values[0] | values[0], 1, target_input=0) == []
+
+
+def test_a_target_that_isnt_an_input_is_written():
+    assert search(lambda values: values[0], 1) == [["LD", "t", "a"]]
+    assert search(lambda values: values[0] ^ values[1] ^ values[1], 2) == [["LD", "t", "a"]]
+
+
+def test_the_top_bit():
+    # copy, shift the top bit into VF and copy VF: nothing shorter computes it on all 256 values.
+    sequence = search(lambda values: values[0] >> 7, 1)
+
+    assert len(sequence) == 3
+    assert search(lambda values: values[0] >> 7, 1, max_length=2) is None
+
+
+def test_lookup_keeps_the_usual_code_when_nothing_is_shorter(memo_file):
+    superoptimizer = Superoptimizer()
+
+    # V1 = V2 + V3 is two instructions, LD and ADD, and there is nothing shorter.
+    assert superoptimizer.lookup("t=a+b", lambda values: values[0] + values[1], 2, None, set(), 2) is None
+    assert superoptimizer.memo["t=a+b"] == {"searched": 1, "sequence": None, "shortest": True}
+
+    superoptimizer.save()
+    with open(memo_file) as file:
+        assert json.load(file)["version"] == superopt.MEMO_VERSION
+
+
+def test_searches_are_remembered(tmp_path, monkeypatch):
+    compile_source(tmp_path, "V3 = V1 >> 7;", superoptimize=True)
+
+    def search(*arguments):
+        raise AssertionError("searched again")
+
+    monkeypatch.setattr(Superoptimizer, "search", search)
+    compile_source(tmp_path, "V4 = V2 >> 7;", superoptimize=True)
+
+
+def test_an_expression_that_changes_nothing_takes_no_code(tmp_path):
+    plain = compile_source(tmp_path, "V1 = (V1 ^ V2) ^ V2;")
+    superoptimized = compile_source(tmp_path, "V1 = (V1 ^ V2) ^ V2;", superoptimize=True)
+
+    # only the endless loop the program stops in is left.
+    assert len(plain) == 3 * 2
+    assert len(superoptimized) == 2
+
+
+@pytest.mark.parametrize("source, function", [
+    ("V3 = V1 >> 7;", lambda x, y: x >> 7),
+    ("V3 = V1 << 6;", lambda x, y: x << 6 & 0xFF),
+    ("V1 = (V1 & 0x0F) | (V2 << 4);", lambda x, y: (x & 0x0F) | (y << 4 & 0xFF)),
+    ("V3 = (V1 + V2) ^ V2;", lambda x, y: (x + y & 0xFF) ^ y),
+    ("V2 = V2 - V1 - V1;", lambda x, y: y - 2 * x & 0xFF),
+])
+def test_superoptimized_code_computes_the_same(tmp_path, source, function):
+    plain = compile_source(tmp_path, source)
+    superoptimized = compile_source(tmp_path, source, superoptimize=True)
+
+    assert len(superoptimized) <= len(plain)
+
+    target = int(source[1])
+    for x in VALUES:
+        for y in VALUES:
+            machine = run(superoptimized, {1: x, 2: y})
+            assert machine.V[target] == function(x, y), (x, y)
+            if target == 3:
+                # the inputs are only ever read.
+                assert machine.V[1:3] == [x, y]
+
+
+def test_states_alike_on_the_sample_are_told_apart(monkeypatch):
+    # on a sample of zeros every sequence looks the same, only running them on every pair tells them apart.
+    monkeypatch.setattr(superopt, "sample_inputs", lambda count: np.zeros((count, 32), dtype=np.uint8))
+
+    assert search(lambda values: values[0] - values[1] - values[1], 2, target_input=0) == [["SUB", "t", "b"]] * 2
+    assert len(search(lambda values: (values[0] + values[1]) ^ values[1], 2)) == 3
+
+
+def test_merging_on_the_sample_alone_is_recorded(monkeypatch):
+    monkeypatch.setattr(superopt, "sample_inputs", lambda count: np.zeros((count, 32), dtype=np.uint8))
+    monkeypatch.setattr(superopt, "MAX_CHECKS", 0)
+
+    # the first length is merged on the sample, anything found past the second could have missed a shorter one.
+    sequence, shortest = Superoptimizer().search(lambda values: (values[0] + values[1]) ^ values[1], 2, None, set(), 3)
+
+    assert sequence is None or len(sequence) == 3
+    assert not shortest
+
+
+def test_the_memo_is_replaced_whole(memo_file, tmp_path):
+    superoptimizer = Superoptimizer()
+    superoptimizer.lookup("t=a", lambda values: values[0], 1, None, set(), 2)
+    superoptimizer.save()
+
+    assert Superoptimizer().memo == superoptimizer.memo
+    assert [path.name for path in tmp_path.iterdir()] == ["superoptimizer.json"]